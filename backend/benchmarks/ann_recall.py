@@ -0,0 +1,94 @@
+"""Recall@k vs. latency of the IVF index against exact flat search.
+
+Run from the backend directory:
+
+    python -m benchmarks.ann_recall --n 100000 --nprobe 1 4 8 16 32
+    python -m benchmarks.ann_recall --from-db
+"""
+
+import argparse
+import time
+import numpy as np
+from vector_index import FlatIndex, IVFIndex
+
+
+def synthetic_features(n: int, dim: int, n_clusters: int = 256, seed: int = 0):
+    """Clustered random vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    noise = 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def time_queries(index, queries: np.ndarray, k: int):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([pid for pid, _ in index.search(query, k=k)])
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, default=50000, help="Catalog size")
+    parser.add_argument("--dim", type=int, default=2048, help="Vector dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=10, help="Results per query")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = auto)")
+    parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument(
+        "--from-db", action="store_true", help="Use stored product features"
+    )
+    args = parser.parse_args()
+
+    if args.from_db:
+        from database import load_product_features
+
+        stored = load_product_features()
+        features = np.vstack(list(stored.values())).astype(np.float32)
+    else:
+        features = synthetic_features(args.n, args.dim)
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(features), min(args.queries, len(features)), replace=False)
+    queries = features[picks] + 0.1 * rng.standard_normal(
+        (len(picks), features.shape[1])
+    ).astype(np.float32)
+    catalog = {i: features[i] for i in range(len(features))}
+
+    flat = FlatIndex()
+    flat.build(catalog)
+    truth, flat_ms = time_queries(flat, queries, args.k)
+
+    ivf = IVFIndex(nlist=args.nlist, min_train_size=1)
+    start = time.perf_counter()
+    ivf.build(catalog)
+    build_s = time.perf_counter() - start
+
+    print(f"catalog={len(features)} dim={features.shape[1]} k={args.k}")
+    print(f"IVF build: {build_s:.2f}s, lists: {len(ivf._lists)}")
+    print(f"{'backend':<12}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(
+        f"{'flat':<12}{1.0:>10.3f}"
+        f"{np.percentile(flat_ms, 50):>10.2f}{np.percentile(flat_ms, 95):>10.2f}"
+    )
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        found, ivf_ms = time_queries(ivf, queries, args.k)
+        recall = np.mean(
+            [len(set(f) & set(t)) / max(len(t), 1) for f, t in zip(found, truth)]
+        )
+        print(
+            f"{'ivf/' + str(nprobe):<12}{recall:>10.3f}"
+            f"{np.percentile(ivf_ms, 50):>10.2f}{np.percentile(ivf_ms, 95):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Speed and agreement of the LUT and k-means dominant-colour classifiers.
+
+Run from the backend directory:
+
+    python -m benchmarks.color_methods --n 256
+    python -m benchmarks.color_methods --from-cache
+"""
+
+import argparse
+import io
+import os
+import time
+import numpy as np
+from PIL import Image
+from color_classifier import get_dominant_colors, get_dominant_color_kmeans, color_lut
+from config import IMAGE_CACHE_DIR
+
+# Garment colours (RGB) for synthetic product shots
+SYNTHETIC_COLORS = {
+    "red": (200, 25, 30),
+    "orange": (230, 120, 20),
+    "yellow": (230, 210, 30),
+    "green": (30, 150, 50),
+    "blue": (30, 60, 200),
+    "purple": (120, 40, 160),
+    "black": (20, 20, 20),
+    "white": (250, 250, 250),
+}
+
+
+def synthetic_images(n: int, seed: int = 0):
+    """Garment-coloured rectangles on light or dark backgrounds, with labels."""
+    rng = np.random.default_rng(seed)
+    names = list(SYNTHETIC_COLORS)
+    images, labels = [], []
+    for _ in range(n):
+        name = names[rng.integers(len(names))]
+        background = 235 if name != "white" else 40
+        array = np.full((400, 300, 3), background, dtype=np.uint8)
+        top, left = rng.integers(20, 120), rng.integers(20, 90)
+        array[top : top + 240, left : left + 180] = SYNTHETIC_COLORS[name]
+        noise = rng.integers(-12, 13, array.shape)
+        images.append(Image.fromarray(np.clip(array + noise, 0, 255).astype(np.uint8)))
+        labels.append(name)
+    return images, labels
+
+
+def cached_images(n: int):
+    images = []
+    for name in sorted(os.listdir(IMAGE_CACHE_DIR))[:n]:
+        try:
+            with open(os.path.join(IMAGE_CACHE_DIR, name), "rb") as f:
+                images.append(Image.open(io.BytesIO(f.read())).convert("RGB"))
+        except Exception:
+            continue
+    return images, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, default=256, help="Number of images")
+    parser.add_argument("--batch-size", type=int, default=32, help="LUT batch size")
+    parser.add_argument(
+        "--from-cache", action="store_true", help="Use downloaded product images"
+    )
+    args = parser.parse_args()
+
+    images, labels = cached_images(args.n) if args.from_cache else synthetic_images(args.n)
+    if not images:
+        raise SystemExit("No images found")
+
+    start = time.perf_counter()
+    color_lut()
+    lut_build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lut = []
+    for i in range(0, len(images), args.batch_size):
+        lut.extend(get_dominant_colors(images[i : i + args.batch_size]))
+    lut_ms = (time.perf_counter() - start) * 1000 / len(images)
+
+    start = time.perf_counter()
+    kmeans = [get_dominant_color_kmeans(image) for image in images]
+    kmeans_ms = (time.perf_counter() - start) * 1000 / len(images)
+
+    print(f"images={len(images)} lut build: {lut_build_s:.2f}s")
+    print(f"{'method':<10}{'ms/image':>10}{'accuracy':>10}")
+    for name, found, ms in (("lut", lut, lut_ms), ("kmeans", kmeans, kmeans_ms)):
+        accuracy = (
+            f"{np.mean([f == l for f, l in zip(found, labels)]):>10.3f}"
+            if labels
+            else f"{'-':>10}"
+        )
+        print(f"{name:<10}{ms:>10.2f}{accuracy}")
+    print(f"agreement: {np.mean([a == b for a, b in zip(lut, kmeans)]):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Embedding drift, classification agreement and speed of the optimized models vs. FP32.
+
+Uses the optimization settings from the environment (MODEL_QUANTIZATION,
+MODEL_COMPILE, MODEL_CHANNELS_LAST, TORCH_NUM_THREADS). Run from the
+backend directory:
+
+    MODEL_QUANTIZATION=static MODEL_COMPILE=torchscript python -m benchmarks.model_drift
+    python -m benchmarks.model_drift --from-cache --n 256
+"""
+
+import argparse
+import copy
+import time
+import numpy as np
+import torch
+from benchmarks.color_methods import cached_images, synthetic_images
+from image_utils import (
+    _calibration_batches,
+    extract_features_batch,
+    get_model,
+    transform,
+)
+from model_optimization import ClipImageEncoder, cosine_drift, optimize_model
+
+
+def timed(fn, batches):
+    """Run fn over batches; return stacked outputs and milliseconds per item."""
+    fn(batches[0])  # warm-up
+    outputs = []
+    start = time.perf_counter()
+    for batch in batches:
+        outputs.append(fn(batch))
+    elapsed = time.perf_counter() - start
+    items = sum(len(batch) for batch in batches)
+    return np.vstack(outputs), elapsed * 1000 / items
+
+
+def neighbour_agreement(baseline: np.ndarray, optimized: np.ndarray, k: int) -> float:
+    """Mean overlap of each item's top-k neighbours under both embeddings."""
+    def neighbours(vectors):
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    a, b = neighbours(baseline), neighbours(optimized)
+    return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(a, b)]))
+
+
+def report(name, baseline, optimized, base_ms, opt_ms, k):
+    drift = cosine_drift(baseline, optimized)
+    print(f"\n{name}")
+    print(f"  fp32      {base_ms:8.2f} ms/image")
+    print(f"  optimized {opt_ms:8.2f} ms/image ({base_ms / opt_ms:.2f}x)")
+    print(
+        f"  cosine to fp32: mean {drift['mean_cosine']:.5f}, "
+        f"p5 {drift['p5_cosine']:.5f}, min {drift['min_cosine']:.5f}"
+    )
+    k = min(k, len(baseline) - 1)
+    if k > 0:
+        agreement = neighbour_agreement(baseline, optimized, k)
+        print(f"  top-{k} neighbour agreement: {agreement:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, default=64, help="Number of images")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--k", type=int, default=10, help="Neighbours compared")
+    parser.add_argument(
+        "--models", nargs="+", default=["resnet50", "clip"], choices=["resnet50", "clip"]
+    )
+    parser.add_argument(
+        "--from-cache", action="store_true", help="Use downloaded product images"
+    )
+    args = parser.parse_args()
+
+    images, _ = cached_images(args.n) if args.from_cache else synthetic_images(args.n)
+    if not images:
+        raise SystemExit("No images found")
+    print(f"images={len(images)} threads={torch.get_num_threads()}")
+
+    if "resnet50" in args.models:
+        baseline_model = get_model()
+        optimized_model = optimize_model(
+            copy.deepcopy(baseline_model),
+            "resnet50",
+            torch.zeros(1, 3, 224, 224),
+            supports_static=True,
+            calibration_loader=_calibration_batches,
+        )
+        inputs = [transform(image) for image in images]
+        batches = [
+            inputs[i : i + args.batch_size] for i in range(0, len(inputs), args.batch_size)
+        ]
+        baseline, base_ms = timed(lambda b: extract_features_batch(b, baseline_model), batches)
+        optimized, opt_ms = timed(lambda b: extract_features_batch(b, optimized_model), batches)
+        report("resnet50", baseline, optimized, base_ms, opt_ms, args.k)
+
+    if "clip" in args.models:
+        from fashion_classifier import create_classifier
+
+        classifier = create_classifier()
+        baseline_encoder = ClipImageEncoder(classifier.model).eval()
+        pixel_values = classifier.preprocess(images)
+        batches = [
+            pixel_values[i : i + args.batch_size]
+            for i in range(0, len(pixel_values), args.batch_size)
+        ]
+
+        def embed_baseline(batch):
+            with torch.inference_mode():
+                features = baseline_encoder(torch.from_numpy(batch))
+            return (features / features.norm(dim=-1, keepdim=True)).numpy()
+
+        baseline, base_ms = timed(embed_baseline, batches)
+        optimized, opt_ms = timed(classifier.embed_pixel_values, batches)
+        report("clip vision", baseline, optimized, base_ms, opt_ms, args.k)
+
+        base_categories = [c for c, _ in classifier.classify(baseline)]
+        opt_categories = [c for c, _ in classifier.classify(optimized)]
+        agreement = np.mean([a == b for a, b in zip(base_categories, opt_categories)])
+        print(f"  classification agreement: {agreement:.3f}")
+
+
+if __name__ == "__main__":
+    main()
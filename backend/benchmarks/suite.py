@@ -0,0 +1,307 @@
+"""Benchmark every hot path on a synthetic catalog and save the results as JSON.
+
+Generates a catalog with locally rendered images (no network needed) in a
+fresh data directory, then times model inference, colour classification,
+catalog sync, database loads, startup ingestion and the search endpoints
+through FastAPI's test client. Each entry reports p50/p95/p99 latency,
+throughput and the peak RSS reached so far. Run from the backend
+directory:
+
+    python -m benchmarks.suite --products 10000 --ingest 200 --output before.json
+    python -m benchmarks.suite --products 10000 --ingest 200 --output after.json --compare before.json
+
+Catalog products beyond the ingested sample get synthetic embeddings, so
+large catalogs (up to 1M) exercise loading and search without embedding
+every image.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux)."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def summarize(latencies, items=None, wall_seconds=None) -> dict:
+    """Latency percentiles (ms), throughput (items/s) and peak RSS for one benchmark."""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    wall_seconds = wall_seconds if wall_seconds is not None else latencies.sum() / 1000
+    items = items if items is not None else len(latencies)
+    return {
+        "count": int(len(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "throughput_per_s": items / wall_seconds if wall_seconds > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.results = {}
+
+    def add(self, name: str, summary: dict) -> None:
+        self.results[name] = summary
+        print(
+            f"{name:<28}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}"
+            f"{summary['p99_ms']:>10.2f}{summary['throughput_per_s']:>12.1f}"
+            f"{summary['peak_rss_mb']:>10.0f}"
+        )
+
+    def time_calls(self, name: str, fn, inputs, warmup: int = 1) -> None:
+        """Time fn once per input, after warm-up calls on the first inputs."""
+        for item in inputs[:warmup]:
+            fn(item)
+        latencies = []
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - start)
+        self.add(name, summarize(latencies))
+
+    def time_once(self, name: str, fn, items: int) -> None:
+        """Time a single bulk operation that handles `items` things."""
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        self.add(name, summarize([elapsed], items=items, wall_seconds=elapsed))
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _settings() -> dict:
+    """Environment variables that change performance (see config.py)."""
+    import config
+
+    return {
+        name: getattr(config, name)
+        for name in dir(config)
+        if name.isupper() and isinstance(getattr(config, name), (int, float, str, bool))
+    }
+
+
+def compare(current: dict, previous_path: str) -> None:
+    with open(previous_path) as f:
+        previous = json.load(f)["results"]
+    print(f"\nChange vs {previous_path} (positive = slower / more memory)")
+    print(f"{'benchmark':<28}{'p50':>10}{'p95':>10}{'rss':>10}")
+    for name, result in current.items():
+        if name not in previous:
+            continue
+        before = previous[name]
+
+        def delta(key):
+            return (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+
+        print(
+            f"{name:<28}{delta('p50_ms'):>+9.1f}%{delta('p95_ms'):>+9.1f}%"
+            f"{delta('peak_rss_mb'):>+9.1f}%"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--products", type=int, default=1000, help="Catalog size")
+    parser.add_argument("--images", type=int, default=500, help="Distinct images")
+    parser.add_argument("--ingest", type=int, default=100, help="Products embedded by ingestion")
+    parser.add_argument("--samples", type=int, default=32, help="Calls per model benchmark")
+    parser.add_argument("--queries", type=int, default=50, help="Requests per endpoint")
+    parser.add_argument("--data-dir", help="Data directory (default: a new temp dir)")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results path")
+    parser.add_argument("--compare", help="Earlier results JSON to diff against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Everything the app writes goes to the benchmark's own data directory
+    data_dir = os.path.abspath(args.data_dir or tempfile.mkdtemp(prefix="emali-bench-"))
+    os.environ["APP_DATA_DIR"] = data_dir
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    from benchmarks.ann_recall import synthetic_features
+    from benchmarks.synthetic_catalog import ADJECTIVES, GARMENTS, generate_catalog, render_image
+    from benchmarks.color_methods import SYNTHETIC_COLORS
+    from config import PRODUCTS_FILE, EMBEDDING_MODEL
+
+    print(f"Generating {args.products} products in {data_dir}...")
+    catalog_path = generate_catalog(args.products, data_dir, args.images, seed=args.seed)
+    if os.path.abspath(catalog_path) != os.path.abspath(PRODUCTS_FILE):
+        raise SystemExit(f"config was imported before APP_DATA_DIR was set ({PRODUCTS_FILE})")
+
+    import database
+    from catalog_sync import sync_catalog
+    from color_classifier import get_dominant_color
+    from image_utils import decode_image, extract_features, load_model
+    from ingestion import StageStats, ingest_products
+
+    recorder = Recorder()
+    print(f"\n{'benchmark':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per s':>12}{'rss MB':>10}")
+
+    database.init_db()
+    recorder.time_once("catalog_sync", lambda: sync_catalog(catalog_path), args.products)
+
+    # Models
+    from fashion_classifier import create_classifier
+
+    start = time.perf_counter()
+    classifier = create_classifier()
+    model = load_model()
+    load_seconds = time.perf_counter() - start
+    recorder.add("load_models", summarize([load_seconds], items=1))
+
+    image_dir = os.path.join(data_dir, "synthetic_images")
+    samples = []
+    for i in range(min(args.samples, args.images, args.products)):
+        with open(os.path.join(image_dir, f"{i}.jpg"), "rb") as f:
+            samples.append(f.read())
+    images = [decode_image(data) for data in samples]
+
+    recorder.time_calls("decode_image", decode_image, samples)
+    if model is not None:
+        recorder.time_calls("extract_features", lambda image: extract_features(image, model), images)
+    recorder.time_calls("classifier_predict", classifier.predict, images)
+    recorder.time_calls("dominant_color", get_dominant_color, images)
+
+    # Startup ingestion over the first products, with cold image and tensor caches
+    pending = database.load_products_without_features()[: args.ingest]
+    stats = StageStats()
+    recorder.time_once(
+        "ingestion",
+        lambda: ingest_products(pending, model, classifier, stats=stats),
+        len(pending),
+    )
+
+    # Synthetic embeddings for the rest of the catalog, in chunks
+    stored = database.load_product_features()
+    if stored:
+        dim = next(iter(stored.values())).shape[1]
+    else:
+        dim = classifier.embed_images(images[:1]).shape[1] if model is None else 2048
+    remaining = [p["id"] for p in database.load_products_without_features()]
+    rng = np.random.default_rng(args.seed)
+    categories = list(GARMENTS)
+    colors = list(SYNTHETIC_COLORS)
+    for start in range(0, len(remaining), 10000):
+        ids = remaining[start : start + 10000]
+        features = synthetic_features(len(ids), dim, seed=args.seed + start)
+        database.save_processed_products(
+            [
+                {
+                    "id": pid,
+                    "features": vector,
+                    "category": categories[int(rng.integers(len(categories)))],
+                    "color": colors[int(rng.integers(len(colors)))],
+                }
+                for pid, vector in zip(ids, features)
+            ]
+        )
+
+    recorder.time_calls("load_products", lambda _: database.load_products(), [None] * 5)
+    recorder.time_calls(
+        "load_product_features", lambda _: database.load_product_features(), [None] * 3
+    )
+
+    # End to end through the API
+    from fastapi.testclient import TestClient
+    import main as app_main
+
+    query_rng = np.random.default_rng(args.seed + 1)
+    queries = []
+    for _ in range(args.queries):
+        color = SYNTHETIC_COLORS[colors[int(query_rng.integers(len(colors)))]]
+        buffer = io.BytesIO()
+        render_image(color, query_rng).save(buffer, "JPEG", quality=90)
+        queries.append(buffer.getvalue())
+    words = [w.lower() for w in ADJECTIVES] + [
+        g.lower() for garments in GARMENTS.values() for g in garments
+    ]
+    text_queries = [
+        f"{words[int(query_rng.integers(len(words)))]} {colors[int(query_rng.integers(len(colors)))]}"
+        for _ in range(args.queries)
+    ]
+
+    start = time.perf_counter()
+    with TestClient(app_main.app) as client:
+        while client.get("/readyz").status_code != 200:
+            if app_main.readiness["error"]:
+                raise SystemExit(f"Startup failed: {app_main.readiness['error']}")
+            time.sleep(0.05)
+        ready_seconds = time.perf_counter() - start
+        recorder.add("startup_to_ready", summarize([ready_seconds], items=1))
+        while client.get("/api/ingestion/progress").json()["state"] == "running":
+            time.sleep(0.05)
+
+        def image_search(data):
+            response = client.post(
+                "/api/search/image-search",
+                files={"file": ("query.jpg", data, "image/jpeg")},
+            )
+            response.raise_for_status()
+
+        def text_search(mode):
+            def search(query):
+                client.get(
+                    "/api/search/text", params={"query": query, "mode": mode}
+                ).raise_for_status()
+
+            return search
+
+        recorder.time_calls("api_image_search", image_search, queries)
+        # The same uploads again are served by the query cache
+        recorder.time_calls("api_image_search_repeat", image_search, queries, warmup=0)
+        recorder.time_calls("api_text_search_lexical", text_search("lexical"), text_queries)
+        if EMBEDDING_MODEL == "clip":
+            recorder.time_calls(
+                "api_text_search_semantic", text_search("semantic"), text_queries
+            )
+        recorder.time_calls(
+            "api_products", lambda _: client.get("/api/products").raise_for_status(), [None] * 5
+        )
+
+    output = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "products": args.products,
+            "images": args.images,
+            "ingested": len(pending),
+            "settings": _settings(),
+        },
+        "results": recorder.results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2, default=str)
+    print(f"\nSaved results to {args.output}")
+
+    if args.compare:
+        compare(recorder.results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
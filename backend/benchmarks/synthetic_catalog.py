@@ -0,0 +1,108 @@
+"""Generate a synthetic product catalog with locally rendered images.
+
+Products get plausible names, prices and file:// image URLs, so ingestion
+runs without network access. Large catalogs reuse a smaller pool of
+images. Run from the backend directory:
+
+    python -m benchmarks.synthetic_catalog --n 100000 --images 2000 --out /tmp/catalog
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+from PIL import Image
+from benchmarks.color_methods import SYNTHETIC_COLORS
+
+ADJECTIVES = [
+    "Classic", "Slim", "Oversized", "Vintage", "Organic", "Premium", "Relaxed",
+    "Cropped", "Tailored", "Lightweight", "Quilted", "Ribbed", "Washed", "Stretch",
+]
+GARMENTS = {
+    "tops": ["T-Shirt", "Blouse", "Sweater", "Polo Shirt", "Tank Top", "Hoodie"],
+    "bottoms": ["Jeans", "Chinos", "Shorts", "Skirt", "Cargo Pants", "Trousers"],
+    "dresses": ["Maxi Dress", "Mini Dress", "Wrap Dress", "Shirt Dress"],
+    "outerwear": ["Denim Jacket", "Trench Coat", "Blazer", "Parka", "Cardigan"],
+    "shoes": ["Sneakers", "Chelsea Boots", "Loafers", "Sandals", "Heels"],
+    "accessories": ["Tote Bag", "Scarf", "Beanie", "Leather Belt", "Sunglasses"],
+}
+
+
+def render_image(color, rng: np.random.Generator, size=(600, 800)) -> Image.Image:
+    """A garment-coloured shape on a plain background, with some noise."""
+    width, height = size
+    background = rng.integers(200, 250) if sum(color) < 600 else rng.integers(30, 80)
+    array = np.full((height, width, 3), background, dtype=np.int16)
+
+    top = int(rng.integers(height // 10, height // 4))
+    bottom = int(rng.integers(3 * height // 4, 9 * height // 10))
+    half = int(rng.integers(width // 5, width // 3))
+    center = width // 2 + int(rng.integers(-width // 10, width // 10))
+    # Trapezoid widening towards the bottom, roughly garment-shaped
+    for y in range(top, bottom):
+        spread = half + (y - top) * half // (2 * (bottom - top))
+        array[y, max(0, center - spread) : center + spread] = color
+
+    array += rng.integers(-10, 11, array.shape, dtype=np.int16)
+    return Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+
+
+def generate_catalog(
+    n: int, out_dir: str, n_images: int = 1000, image_size=(600, 800), seed: int = 0
+) -> str:
+    """Write products.json and images under out_dir; return the catalog path."""
+    rng = np.random.default_rng(seed)
+    image_dir = os.path.abspath(os.path.join(out_dir, "synthetic_images"))
+    os.makedirs(image_dir, exist_ok=True)
+
+    colors = list(SYNTHETIC_COLORS)
+    n_images = max(1, min(n_images, n))
+    image_colors = []
+    for i in range(n_images):
+        color = colors[int(rng.integers(len(colors)))]
+        image_colors.append(color)
+        path = os.path.join(image_dir, f"{i}.jpg")
+        if not os.path.exists(path):
+            render_image(SYNTHETIC_COLORS[color], rng, image_size).save(
+                path, "JPEG", quality=90
+            )
+
+    categories = list(GARMENTS)
+    path = os.path.join(out_dir, "products.json")
+    # Written element by element so a million products never sit in memory
+    with open(path, "w") as f:
+        f.write("[\n")
+        for product_id in range(1, n + 1):
+            image = (product_id - 1) % n_images
+            category = categories[int(rng.integers(len(categories)))]
+            garments = GARMENTS[category]
+            name = (
+                f"{ADJECTIVES[int(rng.integers(len(ADJECTIVES)))]} "
+                f"{image_colors[image].title()} "
+                f"{garments[int(rng.integers(len(garments)))]}"
+            )
+            product = {
+                "id": product_id,
+                "name": name,
+                "price": round(float(rng.uniform(9, 300)), 2),
+                "image_url": f"file://{image_dir}/{image}.jpg",
+            }
+            f.write(("" if product_id == 1 else ",\n") + json.dumps(product))
+        f.write("\n]\n")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, default=1000, help="Number of products")
+    parser.add_argument("--images", type=int, default=1000, help="Distinct images")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    path = generate_catalog(args.n, args.out, args.images, seed=args.seed)
+    print(f"Wrote {args.n} products to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe, size-bounded least-recently-used cache with hit/miss counters.
+
+    With ``ttl`` set (seconds), entries older than that count as misses and
+    are dropped when looked up.
+    """
+
+    def __init__(self, max_size: int, ttl: float = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if not self.ttl or time.monotonic() < expires:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class ImageQueryCache:
+    """Two-level cache for image-search queries.
+
+    The exact layer maps the content hash of uploaded bytes to the query
+    embedding and the image's perceptual hash, so a repeated upload skips
+    decode and the forward pass. The near-duplicate layer maps the
+    perceptual hash (plus the search parameters) to ranked matches, so
+    re-encoded or resized copies of an image skip the forward pass and the
+    index scan.
+
+    Ranked matches are keyed by the index version they were computed
+    against, so they stop matching once the index changes and then age out.
+    Each layer tracks the mean cost of the work a hit avoids, measured on
+    misses, to report the latency saved.
+    """
+
+    def __init__(
+        self,
+        embedding_size: int,
+        results_size: int,
+        embedding_ttl: float = 0,
+        results_ttl: float = 0,
+    ):
+        self.embeddings = LRUCache(embedding_size, ttl=embedding_ttl)
+        self.results = LRUCache(results_size, ttl=results_ttl)
+        self._lock = threading.Lock()
+        self._cost: Dict[str, float] = {"embedding": 0.0, "results": 0.0}
+        self._measured: Dict[str, int] = {"embedding": 0, "results": 0}
+        self._saved: Dict[str, float] = {"embedding": 0.0, "results": 0.0}
+
+    def get_embedding(self, digest: str) -> Optional[Tuple[Any, int]]:
+        """(embedding, perceptual hash) for previously seen upload bytes."""
+        entry = self.embeddings.get(digest)
+        if entry is not None:
+            self._record_hit("embedding")
+        return entry
+
+    def put_embedding(
+        self, digest: str, embedding: Any, phash: Optional[int], seconds: float
+    ) -> None:
+        """Cache an embedding along with the time it took to compute."""
+        self.embeddings.put(digest, (embedding, phash))
+        self._record_cost("embedding", seconds)
+
+    def get_results(
+        self, phash: Optional[int], params: Tuple, version: int, embedded: bool = True
+    ) -> Optional[Any]:
+        """Ranked matches for a near-duplicate image, if still current.
+
+        Pass ``embedded=False`` when the query has no embedding yet, so a hit
+        is also credited with the forward pass it avoids. Images without a
+        perceptual hash (``None``) are never shared.
+        """
+        if phash is None:
+            return None
+        matches = self.results.get((phash, version) + tuple(params))
+        if matches is None:
+            return None
+        self._record_hit("results")
+        if not embedded:
+            self._record_hit("embedding")
+        return matches
+
+    def put_results(
+        self,
+        phash: Optional[int],
+        params: Tuple,
+        version: int,
+        matches: Any,
+        seconds: float,
+    ) -> None:
+        if phash is None:
+            return
+        self.results.put((phash, version) + tuple(params), matches)
+        self._record_cost("results", seconds)
+
+    def clear(self) -> None:
+        self.embeddings.clear()
+        self.results.clear()
+
+    def _record_cost(self, layer: str, seconds: float) -> None:
+        with self._lock:
+            self._measured[layer] += 1
+            # Running mean of the cost a hit on this layer avoids
+            self._cost[layer] += (seconds - self._cost[layer]) / self._measured[layer]
+
+    def _record_hit(self, layer: str) -> None:
+        with self._lock:
+            self._saved[layer] += self._cost[layer]
+
+    def stats(self) -> Dict[str, Any]:
+        embeddings = self.embeddings.stats()
+        results = self.results.stats()
+        with self._lock:
+            embeddings["mean_cost_ms"] = self._cost["embedding"] * 1000
+            embeddings["saved_seconds"] = self._saved["embedding"]
+            results["mean_cost_ms"] = self._cost["results"] * 1000
+            results["saved_seconds"] = self._saved["results"]
+        return {"exact": embeddings, "near_duplicate": results}
+
+
+class DiskCache:
+    """Size-bounded directory of files keyed by name, evicting least recently used.
+
+    Writes go to a temporary file in the same directory and are renamed into
+    place, so concurrent processes sharing the directory never see partial
+    files. Reads bump the file's mtime, which orders eviction. Each process
+    tracks an estimate of the directory size and rescans it when the
+    estimate passes ``max_bytes``, deleting the oldest files until it is
+    back under ``low_water`` of the limit.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, low_water: float = 0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = self._scan_size()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def lookup(self, name: str) -> Optional[str]:
+        """Path of a cached file (marking it recently used), or None on a miss."""
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def get_bytes(self, name: str) -> Optional[bytes]:
+        path = self.lookup(name)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another process between lookup and read
+            return None
+
+    def put_bytes(self, name: str, data: bytes) -> None:
+        self.write(name, lambda f: f.write(data))
+
+    def write(self, name: str, writer) -> None:
+        """Atomically create a cache file by calling writer(file_object)."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer(f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path(name))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            self._size += size
+            over_limit = self.max_bytes > 0 and self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used files until under the low-water mark."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.low_water
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+        if evicted:
+            logger.info(f"Evicted {evicted} files from {self.directory}")
+
+    def _scan_size(self) -> int:
+        total = 0
+        for entry in os.scandir(self.directory):
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Any, Dict, Iterator, List
+from database import (
+    transaction,
+    get_metadata,
+    set_metadata,
+    load_product_hashes,
+    upsert_products,
+    reset_product_images,
+    delete_products,
+)
+from config import CATALOG_SYNC_BATCH_SIZE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Characters read from the catalog file at a time
+READ_CHUNK_SIZE = 1 << 16
+
+
+def iter_catalog(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream the products of a JSON array file one object at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(READ_CHUNK_SIZE).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} does not contain a JSON array")
+        pos = 1
+        eof = False
+
+        while True:
+            # Skip separators between elements
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+
+            try:
+                if pos >= len(buffer):
+                    raise json.JSONDecodeError("Buffer exhausted", buffer, pos)
+                product, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Element spans the chunk boundary: keep the tail, read more
+                buffer = buffer[pos:]
+                pos = 0
+                chunk = f.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+
+            yield product
+
+
+def product_hash(product: Dict[str, Any]) -> str:
+    """Stable hash of a catalog entry's fields."""
+    encoded = json.dumps(product, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def _file_signature(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def sync_catalog(
+    path: str, batch_size: int = CATALOG_SYNC_BATCH_SIZE, force: bool = False
+) -> Dict[str, Any]:
+    """Bring the products table in line with a catalog file.
+
+    New and changed products are upserted in batches, products missing from
+    the file are deleted, and products whose image URL changed lose their
+    features, category and color so ingestion re-embeds them. Everything
+    runs in one transaction. Unchanged products cost only a hash comparison,
+    and an unchanged file (same size and mtime as the last sync) is skipped
+    without being read.
+
+    Returns counts of inserted, updated, re-imaged, deleted and unchanged
+    products.
+    """
+    started = time.perf_counter()
+    signature = _file_signature(path)
+    summary = {
+        "inserted": 0,
+        "updated": 0,
+        "image_changed": 0,
+        "deleted": 0,
+        "unchanged": 0,
+        "skipped": False,
+    }
+    if not force and get_metadata("catalog_signature") == signature:
+        summary["skipped"] = True
+        logger.info(f"Catalog {path} unchanged since last sync")
+        return summary
+
+    existing = load_product_hashes()
+    seen = set()
+    changed: List[Dict[str, Any]] = []
+    new_images: List[int] = []
+
+    with transaction():
+        for product in iter_catalog(path):
+            product_id = product["id"]
+            seen.add(product_id)
+            digest = product_hash(product)
+
+            stored = existing.get(product_id)
+            if stored is not None and stored[0] == digest:
+                summary["unchanged"] += 1
+                continue
+
+            if stored is None:
+                summary["inserted"] += 1
+            else:
+                summary["updated"] += 1
+                if stored[1] != product["image_url"]:
+                    new_images.append(product_id)
+
+            changed.append({**product, "content_hash": digest})
+            if len(changed) >= batch_size:
+                upsert_products(changed)
+                changed = []
+
+        upsert_products(changed)
+        reset_product_images(new_images)
+
+        removed = [product_id for product_id in existing if product_id not in seen]
+        delete_products(removed)
+        set_metadata("catalog_signature", signature)
+
+    summary["image_changed"] = len(new_images)
+    summary["deleted"] = len(removed)
+    logger.info(
+        f"Synced catalog {path} in {time.perf_counter() - started:.2f}s: "
+        f"{summary['inserted']} inserted, {summary['updated']} updated "
+        f"({summary['image_changed']} new images), {summary['deleted']} deleted, "
+        f"{summary['unchanged']} unchanged"
+    )
+    return summary
@@ -1,8 +1,9 @@
 import numpy as np
 import cv2
 from PIL import Image
-from sklearn.cluster import MiniBatchKMeans
-import time
+from typing import List, Optional
+from config import COLOR_METHOD
+from metrics import timed
 
 
 # Define precise color ranges in HSV
@@ -26,10 +27,8 @@ COLOR_RANGES = {
 
 
 def create_mask(image):
-    """Create a simple mask for the main object using basic thresholding."""
+    """Create a mask for the main object, separating it from the background."""
     try:
-        start_time = time.time()
-
         # Convert PIL Image to cv2 format
         img = np.array(image)
 
@@ -40,35 +39,166 @@ def create_mask(image):
             new_size = tuple(int(dim * scale) for dim in img.shape[:2][::-1])
             img = cv2.resize(img, new_size)
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        return foreground_masks(img[None])[0]
+
+    except Exception as e:
+        return np.ones(img.shape[:2], dtype=np.uint8)
 
-        # Simple binary thresholding
-        _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
 
-        # Find contours
-        contours, _ = cv2.findContours(
-            binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+# Colour names indexed by lookup-table value; anything else is unmatched
+COLOR_NAMES = list(COLOR_RANGES)
+UNMATCHED = len(COLOR_NAMES)
+
+# Images are resized to this square before per-pixel classification
+THUMBNAIL_SIZE = 64
+
+# Per-channel RGB distance from the border colour that counts as foreground
+FOREGROUND_THRESHOLD = 40
+# Fall back to the whole image when less than this fraction is foreground
+MIN_FOREGROUND_FRACTION = 0.05
+
+_lut: Optional[np.ndarray] = None
+
+
+def _match_color(h, s, v):
+    """Colour index for HSV values (scalars or arrays), using the centroid rules."""
+    h, s, v = (np.asarray(c, dtype=np.int32) for c in (h, s, v))
+    result = np.full(np.broadcast(h, s, v).shape, UNMATCHED, dtype=np.uint8)
+    unassigned = np.ones(result.shape, dtype=bool)
+
+    # Grayscale first, as in the k-means path
+    grayscale = (s < 30) | (v < 30) | (v > 240)
+    for name, condition in (
+        ("white", v > 200),
+        ("black", v < 50),
+        ("gray", np.ones(result.shape, dtype=bool)),
+    ):
+        hit = unassigned & grayscale & condition
+        result[hit] = COLOR_NAMES.index(name)
+        unassigned &= ~hit
+    unassigned &= ~grayscale
+
+    # Then the first matching range, in COLOR_RANGES order
+    for index, (name, ranges) in enumerate(COLOR_RANGES.items()):
+        if name == "red":
+            in_range = ((h <= 10) | (h >= 160)) & (s >= 70) & (v >= 50)
+        else:
+            in_range = np.zeros(result.shape, dtype=bool)
+            for (h_min, s_min, v_min), (h_max, s_max, v_max) in ranges:
+                in_range |= (
+                    (h >= h_min) & (h <= h_max)
+                    & (s >= s_min) & (s <= s_max)
+                    & (v >= v_min) & (v <= v_max)
+                )
+        hit = unassigned & in_range
+        result[hit] = index
+        unassigned &= ~hit
+
+    return result
+
+
+def color_lut() -> np.ndarray:
+    """180x256x256 uint8 table mapping OpenCV HSV to a colour index (built once)."""
+    global _lut
+    if _lut is None:
+        h, s, v = np.meshgrid(
+            np.arange(180), np.arange(256), np.arange(256), indexing="ij", sparse=True
         )
+        _lut = _match_color(h, s, v)
+    return _lut
+
+
+def _thumbnails(images) -> np.ndarray:
+    """Stack images as (N, THUMBNAIL_SIZE, THUMBNAIL_SIZE, 3) uint8 RGB."""
+    size = (THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+    return np.stack(
+        [np.asarray(image.convert("RGB").resize(size, Image.BILINEAR)) for image in images]
+    )
+
+
+def foreground_masks(stack: np.ndarray) -> np.ndarray:
+    """Boolean foreground masks for an (N, H, W, 3) RGB stack.
+
+    The background colour of each image is taken as the median of its
+    border pixels, and pixels far enough from it count as foreground.
+    Images with almost no foreground (e.g. full-bleed shots) keep every
+    pixel.
+    """
+    stack = np.asarray(stack, dtype=np.int16)
+    border = np.concatenate(
+        [stack[:, 0], stack[:, -1], stack[:, :, 0], stack[:, :, -1]], axis=1
+    )
+    background = np.median(border, axis=1)[:, None, None, :]
+    masks = (np.abs(stack - background) > FOREGROUND_THRESHOLD).any(axis=3)
+
+    too_small = masks.mean(axis=(1, 2)) < MIN_FOREGROUND_FRACTION
+    masks[too_small] = True
+    return masks
+
+
+def color_histograms(stack: np.ndarray) -> np.ndarray:
+    """(N, len(COLOR_NAMES)) foreground-weighted colour fractions for an RGB stack."""
+    n, height, width, _ = stack.shape
+    # One HSV conversion for the whole stack
+    hsv = cv2.cvtColor(
+        np.ascontiguousarray(stack).reshape(n * height, width, 3), cv2.COLOR_RGB2HSV
+    ).reshape(n, height * width, 3)
+    labels = color_lut()[hsv[..., 0], hsv[..., 1], hsv[..., 2]].astype(np.int64)
+
+    weights = foreground_masks(stack).reshape(n, -1).astype(np.float32)
+    offsets = np.arange(n)[:, None] * (UNMATCHED + 1)
+    counts = np.bincount(
+        (labels + offsets).ravel(), weights=weights.ravel(), minlength=n * (UNMATCHED + 1)
+    ).reshape(n, UNMATCHED + 1)
+
+    # Unmatched pixels count towards the total but not towards any colour
+    return counts[:, :UNMATCHED] / weights.sum(axis=1, keepdims=True)
+
+
+def _pick_color(fractions: np.ndarray) -> str:
+    """Dominant colour name from colour fractions, with the k-means path's thresholds."""
+    order = np.argsort(-fractions)
+    first, second = fractions[order[0]], fractions[order[1]]
+    if first <= 0:
+        return "other"
+    if first > 0.4:
+        return COLOR_NAMES[order[0]]
+    if first > 0.3 and second > 0.2:
+        return "other"
+    return COLOR_NAMES[order[0]]
 
-        if not contours:
-            return np.ones(img.shape[:2], dtype=np.uint8)
 
-        # Create mask from all contours
-        mask = np.zeros_like(gray)
-        cv2.drawContours(mask, contours, -1, 255, -1)
+@timed("color")
+def get_dominant_colors(images: List[Image.Image]) -> List[str]:
+    """Dominant colour of each image, classified per pixel in one batched pass."""
+    if not images:
+        return []
+    try:
+        histograms = color_histograms(_thumbnails(images))
+        return [_pick_color(fractions) for fractions in histograms]
+    except Exception as e:
+        return ["other"] * len(images)
 
-        return mask > 0
 
-    except Exception as e:
-        return np.ones(img.shape[:2], dtype=np.uint8)
+def get_dominant_color(image, n_colors=3, method=None):
+    """Get the dominant color of a clothing item in an image.
 
+    ``method`` is "lut" (per-pixel lookup over the foreground) or "kmeans"
+    (cluster the whole image and match the centroids); it defaults to
+    COLOR_METHOD.
+    """
+    if (method or COLOR_METHOD) == "lut":
+        return get_dominant_colors([image])[0]
+    return get_dominant_color_kmeans(image, n_colors)
 
-def get_dominant_color(image, n_colors=3):
+
+@timed("color")
+def get_dominant_color_kmeans(image, n_colors=3):
     """Get the dominant color(s) of a clothing item in an image."""
-    try:
-        start_time = time.time()
+    # scikit-learn is only needed on this path
+    from sklearn.cluster import MiniBatchKMeans
 
+    try:
         # Resize image for faster processing
         img = image.copy()
         img.thumbnail((100, 100))
@@ -12,5 +12,126 @@ DB_PATH = os.path.join(BASE_DATA_DIR, "products.db")
 IMAGE_CACHE_DIR = os.path.join(BASE_DATA_DIR, "image_cache")
 PRODUCTS_FILE = os.path.join(BASE_DATA_DIR, "products.json")
 
+# SQLite tuning: pooled read connections, WAL sync level and memory-mapped I/O
+DB_READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", "8"))
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
 # Ensure image cache directory exists
 os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+
+# Preprocessed model inputs, memory-mappable .npy keyed by image content
+TENSOR_CACHE_DIR = os.path.join(BASE_DATA_DIR, "tensor_cache")
+# Size bounds for the on-disk caches (0 = unbounded)
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(2 * 1024**3)))
+TENSOR_CACHE_MAX_BYTES = int(os.environ.get("TENSOR_CACHE_MAX_BYTES", str(4 * 1024**3)))
+
+# Similarity embeddings: "resnet50" (separate ResNet50 features) or "clip"
+# (reuse the CLIP image embedding computed for classification)
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "resnet50")
+
+# Similarity index backend: "flat" (exact) or "ivf" (approximate)
+INDEX_BACKEND = os.environ.get("INDEX_BACKEND", "flat")
+# Number of IVF lists (0 picks ~4*sqrt(N)) and lists scanned per query
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))
+# Compressed index storage: "none", "float16", "int8" or "pq"
+EMBEDDING_COMPRESSION = os.environ.get("EMBEDDING_COMPRESSION", "none")
+# Project vectors to this many PCA dimensions before quantization (0 = off)
+PCA_DIM = int(os.environ.get("PCA_DIM", "0"))
+# One byte per subvector with product quantization
+PQ_SUBVECTORS = int(os.environ.get("PQ_SUBVECTORS", "64"))
+# Candidates re-scored with full-precision vectors from the database (0 = off)
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "100"))
+# Persisted index lives next to the database
+INDEX_PATH = os.path.splitext(DB_PATH)[0] + ".index.npz"
+
+# Startup ingestion: images per model batch and worker pool sizes
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "16"))
+INGEST_DOWNLOAD_WORKERS = int(os.environ.get("INGEST_DOWNLOAD_WORKERS", "8"))
+INGEST_DECODE_WORKERS = int(os.environ.get("INGEST_DECODE_WORKERS", "4"))
+# Seconds before a stalled image download fails (counted as a failed product)
+INGEST_DOWNLOAD_TIMEOUT = float(os.environ.get("INGEST_DOWNLOAD_TIMEOUT", "30"))
+
+# Cached CLIP prompt embeddings, keyed by model and prompt set (empty disables)
+TEXT_FEATURES_CACHE_DIR = os.environ.get(
+    "TEXT_FEATURES_CACHE_DIR", os.path.join(BASE_DATA_DIR, "text_features")
+)
+
+# Request-time inference: micro-batch limits and inference thread count
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", "16"))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("INFERENCE_MAX_WAIT_MS", "5"))
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "1"))
+
+# Semantic text search: cached CLIP query embeddings
+TEXT_QUERY_CACHE_SIZE = int(os.environ.get("TEXT_QUERY_CACHE_SIZE", "1024"))
+
+# Image search query cache: embeddings by upload bytes, ranked results by
+# perceptual hash (entry counts and TTLs in seconds, 0 = no expiry)
+IMAGE_QUERY_CACHE_SIZE = int(os.environ.get("IMAGE_QUERY_CACHE_SIZE", "1024"))
+IMAGE_QUERY_CACHE_TTL = float(os.environ.get("IMAGE_QUERY_CACHE_TTL", "3600"))
+IMAGE_RESULT_CACHE_SIZE = int(os.environ.get("IMAGE_RESULT_CACHE_SIZE", "1024"))
+IMAGE_RESULT_CACHE_TTL = float(os.environ.get("IMAGE_RESULT_CACHE_TTL", "300"))
+
+# Most images accepted by one /api/search/image-search/batch request
+IMAGE_SEARCH_BATCH_MAX_FILES = int(os.environ.get("IMAGE_SEARCH_BATCH_MAX_FILES", "32"))
+
+# Dominant colour: "lut" (per-pixel lookup over the foreground, batched) or
+# "kmeans" (per-image MiniBatchKMeans over all pixels)
+COLOR_METHOD = os.environ.get("COLOR_METHOD", "lut")
+
+# Catalog sync from PRODUCTS_FILE: changed products written per executemany batch
+CATALOG_SYNC_BATCH_SIZE = int(os.environ.get("CATALOG_SYNC_BATCH_SIZE", "1000"))
+
+# CPU inference optimizations for ResNet50 and the CLIP vision tower.
+# Quantization: "none", "dynamic" (int8 Linear layers) or "static" (calibrated
+# int8 ResNet; CLIP falls back to dynamic). Compile: "none", "torchscript"
+# (traced and frozen) or "inductor" (torch.compile at load). Quantized and
+# TorchScript models are exported once to MODEL_CACHE_DIR.
+MODEL_QUANTIZATION = os.environ.get("MODEL_QUANTIZATION", "none")
+MODEL_COMPILE = os.environ.get("MODEL_COMPILE", "none")
+MODEL_CHANNELS_LAST = os.environ.get("MODEL_CHANNELS_LAST", "0") == "1"
+MODEL_CACHE_DIR = os.path.join(BASE_DATA_DIR, "models")
+# Intra-op threads for inference (0 = all available cores)
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", "0"))
+
+# Images are decoded straight to (at least) this shortest side, using JPEG
+# draft mode, and every model input is derived from that one buffer
+IMAGE_DECODE_SIZE = int(os.environ.get("IMAGE_DECODE_SIZE", "256"))
+
+# Settings that change the embeddings: recorded with each version built by
+# reindex.py, and a server only switches to versions built with its own
+EMBEDDING_SETTINGS = {
+    "EMBEDDING_MODEL": EMBEDDING_MODEL,
+    "IMAGE_DECODE_SIZE": IMAGE_DECODE_SIZE,
+    "MODEL_QUANTIZATION": MODEL_QUANTIZATION,
+    "MODEL_COMPILE": MODEL_COMPILE,
+    "MODEL_CHANNELS_LAST": MODEL_CHANNELS_LAST,
+}
+
+# Add a Server-Timing header with per-stage durations to every response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# Opt-in profiling: the fraction of requests whose Python stacks are sampled
+# (every PROFILE_INTERVAL_MS), and a token that profiles any request sending
+# it in an X-Profile header and unlocks the /admin/profiles endpoints. The
+# last PROFILE_HISTORY profiles are kept in memory.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_HISTORY = int(os.environ.get("PROFILE_HISTORY", "20"))
+
+# /api/products: pre-serialized pages kept per catalog version (entry count)
+PRODUCTS_PAGE_CACHE_SIZE = int(os.environ.get("PRODUCTS_PAGE_CACHE_SIZE", "64"))
+
+# Serving with serve.py: worker processes forked after models and the index
+# are loaded, and how often workers save (the ingesting worker) or reload
+# (the others) the shared index file, in seconds. Servers also check for a
+# newly activated embedding version this often.
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", "1"))
+INDEX_SYNC_SECONDS = float(os.environ.get("INDEX_SYNC_SECONDS", "30"))
+
+# reindex.py: embedding processes, and the share of the catalog a version
+# must cover before it can be activated
+REINDEX_WORKERS = int(os.environ.get("REINDEX_WORKERS", "2"))
+REINDEX_MIN_COVERAGE = float(os.environ.get("REINDEX_MIN_COVERAGE", "0.99"))
@@ -1,140 +1,909 @@
 import sqlite3
 import json
+import re
+import time
+import queue
+import threading
 import numpy as np
-from typing import List, Dict, Any
-import os
-from config import DB_PATH
+from contextlib import contextmanager
+from typing import List, Dict, Any, Callable, Iterator, Optional, Sequence
+from config import DB_PATH, DB_READ_POOL_SIZE, DB_MMAP_SIZE, DB_SYNCHRONOUS
+from metrics import timed
+
+# Tag of the embeddings that existed before the first re-index
+INITIAL_EMBEDDING_VERSION = "initial"
+# Embedding version tags name tables and files
+EMBEDDING_VERSION_TAG = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class ConnectionManager:
+    """Long-lived SQLite connections: a pool of readers and a single writer.
+
+    Connections use WAL journaling so readers never block the writer, and
+    keep their prepared-statement cache across calls. All writes go through
+    one connection guarded by a lock, so writers queue in-process instead of
+    contending for SQLite's file lock.
+    """
+
+    def __init__(self, path: str, read_pool_size: int = DB_READ_POOL_SIZE):
+        self.path = path
+        self.read_pool_size = read_pool_size
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read connection from the pool."""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < self.read_pool_size
+                if create:
+                    self._reader_count += 1
+            conn = self._connect() if create else self._readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements on the writer connection in one transaction."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            if conn.in_transaction:
+                # Nested use joins the outer transaction
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def close(self) -> None:
+        """Close every connection; new ones are opened on next use."""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._reader_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reader_count = 0
+
+
+_connections = ConnectionManager(DB_PATH)
+
+
+def reader():
+    """Context manager yielding a pooled read connection."""
+    return _connections.reader()
+
+
+def transaction():
+    """Context manager yielding the writer connection inside one transaction."""
+    return _connections.transaction()
+
+
+def close_connections():
+    """Close pooled connections (e.g. at shutdown or before forking)."""
+    _connections.close()
+
+
+# Callbacks notified with (product_id, features) whenever features are saved
+_feature_listeners: List[Callable[[int, np.ndarray], None]] = []
+
+
+def add_feature_listener(listener: Callable[[int, np.ndarray], None]):
+    """Register a callback to run after product features are saved."""
+    _feature_listeners.append(listener)
+
+
+# Callbacks notified with (product_id, attributes) when category or color change
+_attribute_listeners: List[Callable[[int, Dict[str, Any]], None]] = []
+
+
+def add_attribute_listener(listener: Callable[[int, Dict[str, Any]], None]):
+    """Register a callback to run after product category and color are saved."""
+    _attribute_listeners.append(listener)
+
+
+def _row_to_product(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "name": row[1],
+        "price": row[2],
+        "image_url": row[3],
+        "category": row[4],
+        "color": row[5],
+    }
 
 
 def init_db():
     """Initialize the database with required tables."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with transaction() as conn:
+        c = conn.cursor()
+
+        # Create products table
+        c.execute("""CREATE TABLE IF NOT EXISTS products
+                     (id INTEGER PRIMARY KEY,
+                      name TEXT,
+                      price REAL,
+                      image_url TEXT,
+                      category TEXT,
+                      color TEXT)""")
+
+        # Hash of the catalog entry, so syncs only touch changed products
+        c.execute("SELECT 1 FROM pragma_table_info('products') WHERE name = 'content_hash'")
+        if c.fetchone() is None:
+            c.execute("ALTER TABLE products ADD COLUMN content_hash TEXT")
+
+        # Create product_features table
+        c.execute("""CREATE TABLE IF NOT EXISTS product_features
+                     (product_id INTEGER PRIMARY KEY,
+                      features BLOB,
+                      image_url TEXT)""")
+
+        # Image each feature row was computed from, so re-indexed versions can
+        # tell which rows went stale while they were built
+        c.execute(
+            "SELECT 1 FROM pragma_table_info('product_features') WHERE name = 'image_url'"
+        )
+        if c.fetchone() is None:
+            c.execute("ALTER TABLE product_features ADD COLUMN image_url TEXT")
+            c.execute("""UPDATE product_features SET image_url =
+                         (SELECT image_url FROM products WHERE id = product_id)""")
+
+        # Mirror searchable product columns into an FTS5 index kept in sync by triggers
+        c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        )
+        fts_exists = c.fetchone() is not None
+        c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5
+                     (name, category, color,
+                      content='products', content_rowid='id',
+                      tokenize='unicode61', prefix='2 3')""")
+        c.execute("""CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+                     BEGIN
+                       INSERT INTO products_fts (rowid, name, category, color)
+                       VALUES (new.id, new.name, new.category, new.color);
+                     END""")
+        c.execute("""CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+                     BEGIN
+                       INSERT INTO products_fts (products_fts, rowid, name, category, color)
+                       VALUES ('delete', old.id, old.name, old.category, old.color);
+                     END""")
+        c.execute("""CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products
+                     BEGIN
+                       INSERT INTO products_fts (products_fts, rowid, name, category, color)
+                       VALUES ('delete', old.id, old.name, old.category, old.color);
+                       INSERT INTO products_fts (rowid, name, category, color)
+                       VALUES (new.id, new.name, new.category, new.color);
+                     END""")
+        if not fts_exists:
+            # Index rows that existed before the FTS table
+            c.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+        # Create metadata table
+        c.execute("""CREATE TABLE IF NOT EXISTS app_metadata
+                     (key TEXT PRIMARY KEY,
+                      value TEXT)""")
+
+        # Embedding versions: the live one is product_features, the others
+        # are kept in product_features__<tag> tables (see reindex.py)
+        c.execute("""CREATE TABLE IF NOT EXISTS embedding_versions
+                     (tag TEXT PRIMARY KEY,
+                      model TEXT,
+                      settings TEXT,
+                      status TEXT,
+                      created_at REAL,
+                      activated_at REAL)""")
+        c.execute(
+            """INSERT OR IGNORE INTO app_metadata (key, value)
+                     VALUES ('embedding_version', ?)""",
+            (INITIAL_EMBEDDING_VERSION,),
+        )
+        c.execute(
+            """INSERT OR IGNORE INTO embedding_versions
+                     (tag, model, settings, status, created_at, activated_at)
+                     SELECT value,
+                            (SELECT value FROM app_metadata WHERE key = 'embedding_model'),
+                            NULL, 'live', ?, ?
+                     FROM app_metadata WHERE key = 'embedding_version'""",
+            (time.time(), time.time()),
+        )
+
+
+@timed("db_read")
+def get_metadata(key: str, default: Optional[str] = None) -> Optional[str]:
+    """Get a metadata value from database."""
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT value FROM app_metadata WHERE key = ?", (key,))
+        row = c.fetchone()
+
+    return row[0] if row else default
+
+
+@timed("db_write")
+def set_metadata(key: str, value: str):
+    """Set a metadata value in database."""
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.execute(
+            """INSERT OR REPLACE INTO app_metadata (key, value)
+                     VALUES (?, ?)""",
+            (key, value),
+        )
+
+
+@timed("db_write")
+def set_embedding_model(model: str):
+    """Record the model behind the live embedding version."""
+    with transaction() as conn:
+        c = conn.cursor()
 
-    # Create products table
-    c.execute("""CREATE TABLE IF NOT EXISTS products
-                 (id INTEGER PRIMARY KEY,
-                  name TEXT,
-                  price REAL,
-                  image_url TEXT,
-                  category TEXT,
-                  color TEXT)""")
+        c.execute(
+            """INSERT OR REPLACE INTO app_metadata (key, value)
+                     VALUES ('embedding_model', ?)""",
+            (model,),
+        )
+        c.execute(
+            """UPDATE embedding_versions SET model = ?
+                     WHERE tag = (SELECT value FROM app_metadata WHERE key = 'embedding_version')""",
+            (model,),
+        )
 
-    # Create product_features table
-    c.execute("""CREATE TABLE IF NOT EXISTS product_features
-                 (product_id INTEGER PRIMARY KEY,
-                  features BLOB)""")
 
-    conn.commit()
-    conn.close()
+def _bump_catalog_version(c) -> None:
+    """Mark the products table as changed, inside the caller's transaction."""
+    c.execute(
+        """INSERT INTO app_metadata (key, value) VALUES ('catalog_version', '1')
+                 ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"""
+    )
 
 
+@timed("db_read")
+def get_catalog_version() -> int:
+    """Counter bumped by every write to the products table."""
+    return int(get_metadata("catalog_version", "0"))
+
+
+@timed("db_write")
 def save_products(products: List[Dict[str, Any]]):
     """Save products to database. Skip if product already exists."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with transaction() as conn:
+        c = conn.cursor()
 
-    for product in products:
-        c.execute(
+        c.executemany(
             """INSERT OR IGNORE INTO products (id, name, price, image_url)
                      VALUES (?, ?, ?, ?)""",
-            (product["id"], product["name"], product["price"], product["image_url"]),
+            [
+                (p["id"], p["name"], p["price"], p["image_url"])
+                for p in products
+            ],
         )
-
-    conn.commit()
-    conn.close()
+        _bump_catalog_version(c)
 
 
+@timed("db_read")
 def load_products() -> List[Dict[str, Any]]:
     """Load products from database."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    c.execute("SELECT * FROM products")
-    rows = c.fetchall()
-
-    products = []
-    for row in rows:
-        product = {
-            "id": row[0],
-            "name": row[1],
-            "price": row[2],
-            "image_url": row[3],
-            "category": row[4],
-            "color": row[5],
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT * FROM products")
+        rows = c.fetchall()
+
+        products = [_row_to_product(row) for row in rows]
+
+    return products
+
+
+# Columns of the products table that the API exposes
+PRODUCT_FIELDS = ("id", "name", "price", "image_url", "category", "color")
+
+
+@timed("db_read")
+def load_products_page(
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    fields: Sequence[str] = PRODUCT_FIELDS,
+) -> List[Dict[str, Any]]:
+    """Products in id order, starting after ``after_id``, with only ``fields``.
+
+    Every product includes its id, which callers use as the next cursor.
+    """
+    columns = ["id"] + [f for f in fields if f != "id" and f in PRODUCT_FIELDS]
+    query = f"SELECT {', '.join(columns)} FROM products"
+    params: List[Any] = []
+    if after_id is not None:
+        query += " WHERE id > ?"
+        params.append(after_id)
+    query += " ORDER BY id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute(query, params)
+        products = [dict(zip(columns, row)) for row in c.fetchall()]
+
+    return products
+
+
+@timed("db_read")
+def load_products_without_features() -> List[Dict[str, Any]]:
+    """Load products that have no stored features yet."""
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute("""SELECT p.* FROM products p
+                     LEFT JOIN product_features f ON f.product_id = p.id
+                     WHERE f.product_id IS NULL""")
+        products = [_row_to_product(row) for row in c.fetchall()]
+
+    return products
+
+
+@timed("db_read")
+def load_product_hashes() -> Dict[int, tuple]:
+    """(content hash, image URL) of every product, keyed by id."""
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT id, content_hash, image_url FROM products")
+        hashes = {row[0]: (row[1], row[2]) for row in c.fetchall()}
+
+    return hashes
+
+
+@timed("db_read")
+def load_product_attributes() -> Dict[int, Dict[str, Any]]:
+    """Category, color and price of every product, for filtered search."""
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT id, category, color, price FROM products")
+        attributes = {
+            row[0]: {"category": row[1], "color": row[2], "price": row[3]}
+            for row in c.fetchall()
         }
-        products.append(product)
 
-    conn.close()
+    return attributes
+
+
+@timed("db_write")
+def upsert_products(products: List[Dict[str, Any]]):
+    """Insert or update catalog fields (and content hashes), keeping derived columns."""
+    if not products:
+        return
+
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.executemany(
+            """INSERT INTO products (id, name, price, image_url, content_hash)
+                     VALUES (?, ?, ?, ?, ?)
+                     ON CONFLICT (id) DO UPDATE SET
+                       name = excluded.name,
+                       price = excluded.price,
+                       image_url = excluded.image_url,
+                       content_hash = excluded.content_hash""",
+            [
+                (p["id"], p["name"], p["price"], p["image_url"], p.get("content_hash"))
+                for p in products
+            ],
+        )
+        _bump_catalog_version(c)
+
+
+@timed("db_write")
+def reset_product_images(product_ids: List[int]):
+    """Drop features, category and color derived from products' old images."""
+    if not product_ids:
+        return
+
+    with transaction() as conn:
+        c = conn.cursor()
+
+        ids = json.dumps([int(pid) for pid in product_ids])
+        c.execute(
+            """DELETE FROM product_features
+                     WHERE product_id IN (SELECT value FROM json_each(?))""",
+            (ids,),
+        )
+        c.execute(
+            """UPDATE products SET category = NULL, color = NULL
+                     WHERE id IN (SELECT value FROM json_each(?))""",
+            (ids,),
+        )
+        _bump_catalog_version(c)
+
+
+@timed("db_write")
+def delete_products(product_ids: List[int]):
+    """Delete products and their features."""
+    if not product_ids:
+        return
+
+    with transaction() as conn:
+        c = conn.cursor()
+
+        ids = json.dumps([int(pid) for pid in product_ids])
+        c.execute(
+            """DELETE FROM product_features
+                     WHERE product_id IN (SELECT value FROM json_each(?))""",
+            (ids,),
+        )
+        c.execute(
+            "DELETE FROM products WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+        )
+        _bump_catalog_version(c)
+
+
+def _fts_query(query: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    words = re.findall(r"\w+", query.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+
+@timed("db_read")
+def search_products_text(
+    query: str, limit: Optional[int] = None, offset: int = 0
+) -> List[Dict[str, Any]]:
+    """Full-text search over name, category and color, best bm25 match first."""
+    match = _fts_query(query)
+    if not match:
+        return []
+
+    with reader() as conn:
+        c = conn.cursor()
+
+        # Name matches weigh more than category or color matches
+        c.execute(
+            """SELECT p.*, bm25(products_fts, 10.0, 2.0, 2.0) AS rank
+                     FROM products_fts
+                     JOIN products p ON p.id = products_fts.rowid
+                     WHERE products_fts MATCH ?
+                     ORDER BY rank
+                     LIMIT ? OFFSET ?""",
+            (match, -1 if limit is None else limit, offset),
+        )
+        rows = c.fetchall()
+
+        products = [_row_to_product(row) for row in rows]
+
     return products
 
 
+@timed("db_read")
+def load_products_by_ids(product_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Load the given products from database, keyed by id."""
+    if not product_ids:
+        return {}
+
+    with reader() as conn:
+        c = conn.cursor()
+
+        # Pass ids as one JSON array so the statement text never changes
+        c.execute(
+            "SELECT * FROM products WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([int(pid) for pid in product_ids]),),
+        )
+        products = {row[0]: _row_to_product(row) for row in c.fetchall()}
+
+    return products
+
+
+@timed("db_write")
 def save_product_features(product_id: int, features: np.ndarray):
     """Save product features to database."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with transaction() as conn:
+        c = conn.cursor()
 
-    # Convert numpy array to bytes for storage
-    feature_bytes = features.tobytes()
+        # Convert numpy array to bytes for storage
+        feature_bytes = features.tobytes()
 
-    c.execute(
-        """INSERT OR REPLACE INTO product_features (product_id, features)
-                 VALUES (?, ?)""",
-        (product_id, feature_bytes),
-    )
+        c.execute(
+            """INSERT OR REPLACE INTO product_features (product_id, features, image_url)
+                     VALUES (?, ?, (SELECT image_url FROM products WHERE id = ?))""",
+            (product_id, feature_bytes, product_id),
+        )
 
-    conn.commit()
-    conn.close()
+    for listener in _feature_listeners:
+        listener(product_id, features)
 
 
+@timed("db_read")
 def load_product_features() -> Dict[int, np.ndarray]:
     """Load product features from database."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    c.execute("SELECT product_id, features FROM product_features")
-    rows = c.fetchall()
-
-    features = {}
-    for row in rows:
-        product_id = row[0]
-        # Convert bytes back to numpy array
-        feature_array = np.frombuffer(row[1], dtype=np.float32)
-        # Reshape to match the expected feature dimensions
-        feature_array = feature_array.reshape(1, -1)
-        features[product_id] = feature_array
-
-    conn.close()
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT product_id, features FROM product_features")
+        rows = c.fetchall()
+
+        features = {}
+        for row in rows:
+            product_id = row[0]
+            # Convert bytes back to numpy array
+            feature_array = np.frombuffer(row[1], dtype=np.float32)
+            # Reshape to match the expected feature dimensions
+            feature_array = feature_array.reshape(1, -1)
+            features[product_id] = feature_array
+
+    return features
+
+
+@timed("db_read")
+def load_product_features_by_ids(
+    product_ids: List[int], version: Optional[str] = None
+) -> Dict[int, np.ndarray]:
+    """Load features for the given products from database.
+
+    ``version`` reads a non-live embedding version instead of the live one.
+    """
+    if not product_ids:
+        return {}
+    table = "product_features" if version is None else _version_table(version)
+
+    with reader() as conn:
+        c = conn.cursor()
+
+        # Pass ids as one JSON array so the statement text never changes
+        c.execute(
+            f"""SELECT product_id, features FROM {table}
+                     WHERE product_id IN (SELECT value FROM json_each(?))""",
+            (json.dumps([int(pid) for pid in product_ids]),),
+        )
+        features = {
+            row[0]: np.frombuffer(row[1], dtype=np.float32).reshape(1, -1)
+            for row in c.fetchall()
+        }
+
     return features
 
 
+@timed("db_write")
+def clear_product_features():
+    """Delete all stored product features."""
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.execute("DELETE FROM product_features")
+
+
+@timed("db_write")
 def update_product_attributes(product_id: int, category: str, color: str):
     """Update product category and color."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with transaction() as conn:
+        c = conn.cursor()
 
-    c.execute(
-        """UPDATE products 
-                 SET category = ?, color = ?
-                 WHERE id = ?""",
-        (category, color, product_id),
-    )
+        c.execute(
+            """UPDATE products 
+                     SET category = ?, color = ?
+                     WHERE id = ?""",
+            (category, color, product_id),
+        )
+        _bump_catalog_version(c)
+
+    for listener in _attribute_listeners:
+        listener(product_id, {"category": category, "color": color})
+
+
+@timed("db_write")
+def save_processed_products(
+    results: List[Dict[str, Any]], embedding_version: Optional[str] = None
+) -> bool:
+    """Save features, category and color for many products in one transaction.
+
+    With ``embedding_version``, nothing is saved (and False is returned) if
+    another version has gone live since the features were computed.
+    """
+    if not results:
+        return True
+
+    with transaction() as conn:
+        c = conn.cursor()
+
+        if embedding_version is not None:
+            c.execute("SELECT value FROM app_metadata WHERE key = 'embedding_version'")
+            row = c.fetchone()
+            if row is not None and row[0] != embedding_version:
+                return False
+
+        c.executemany(
+            """INSERT OR REPLACE INTO product_features (product_id, features, image_url)
+                     VALUES (?, ?, ?)""",
+            [
+                (r["id"], r["features"].astype(np.float32).tobytes(), r.get("image_url"))
+                for r in results
+            ],
+        )
+        c.executemany(
+            """UPDATE products 
+                     SET category = ?, color = ?
+                     WHERE id = ?""",
+            [(r["category"], r["color"], r["id"]) for r in results],
+        )
+        _bump_catalog_version(c)
 
-    conn.commit()
-    conn.close()
+    for listener in _feature_listeners:
+        for r in results:
+            listener(r["id"], r["features"])
+    for listener in _attribute_listeners:
+        for r in results:
+            listener(r["id"], {"category": r["category"], "color": r["color"]})
+    return True
 
 
+@timed("db_write")
 def update_product_image_url(product_id: int, image_url: str):
     """Update product image URL."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with transaction() as conn:
+        c = conn.cursor()
 
-    c.execute(
-        """UPDATE products 
-                 SET image_url = ?
-                 WHERE id = ?""",
-        (image_url, product_id),
-    )
+        c.execute(
+            """UPDATE products 
+                     SET image_url = ?
+                     WHERE id = ?""",
+            (image_url, product_id),
+        )
+        _bump_catalog_version(c)
+
+
+
+def _version_table(tag: str) -> str:
+    """Quoted name of the table holding a non-live embedding version."""
+    if not EMBEDDING_VERSION_TAG.match(tag):
+        raise ValueError(f"Invalid embedding version tag: {tag!r}")
+    return f'"product_features__{tag}"'
+
+
+@timed("db_read")
+def get_live_embedding_version() -> str:
+    """Tag of the embedding version held in product_features."""
+    return get_metadata("embedding_version", INITIAL_EMBEDDING_VERSION)
+
+
+@timed("db_read")
+def get_embedding_version_settings(tag: str) -> Optional[Dict[str, Any]]:
+    """Settings an embedding version was built with (None if not recorded)."""
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT settings FROM embedding_versions WHERE tag = ?", (tag,))
+        row = c.fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+@timed("db_read")
+def load_embedding_versions() -> List[Dict[str, Any]]:
+    """Every embedding version with its stored feature count, newest first."""
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute(
+            """SELECT tag, model, settings, status, created_at, activated_at
+                     FROM embedding_versions ORDER BY created_at DESC"""
+        )
+        columns = ["tag", "model", "settings", "status", "created_at", "activated_at"]
+        versions = [dict(zip(columns, row)) for row in c.fetchall()]
+
+        for version in versions:
+            table = (
+                "product_features"
+                if version["status"] == "live"
+                else _version_table(version["tag"])
+            )
+            try:
+                c.execute(f"SELECT COUNT(*) FROM {table}")
+                version["features"] = c.fetchone()[0]
+            except sqlite3.OperationalError:
+                version["features"] = None
+            version["settings"] = json.loads(version["settings"] or "null")
+
+    return versions
+
+
+@timed("db_write")
+def create_embedding_version(tag: str, model: str, settings: Dict[str, Any]):
+    """Register a new embedding version and its (empty) feature table.
+
+    Re-creating a version that is still building keeps its stored features,
+    so an interrupted build resumes.
+    """
+    table = _version_table(tag)
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT status, model FROM embedding_versions WHERE tag = ?", (tag,))
+        row = c.fetchone()
+        if row is not None and row[0] != "building":
+            raise ValueError(f"Embedding version {tag} already exists ({row[0]})")
+        if row is not None and row[1] != model:
+            raise ValueError(f"Embedding version {tag} is being built with {row[1]}")
+
+        c.execute(f"""CREATE TABLE IF NOT EXISTS {table}
+                      (product_id INTEGER PRIMARY KEY,
+                       features BLOB,
+                       image_url TEXT)""")
+        c.execute(
+            """INSERT OR IGNORE INTO embedding_versions
+                     (tag, model, settings, status, created_at)
+                     VALUES (?, ?, ?, 'building', ?)""",
+            (tag, model, json.dumps(settings), time.time()),
+        )
+
+
+@timed("db_write")
+def set_embedding_version_status(tag: str, status: str):
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.execute("UPDATE embedding_versions SET status = ? WHERE tag = ?", (status, tag))
+
+
+@timed("db_read")
+def load_products_without_version_features(tag: str) -> List[Dict[str, Any]]:
+    """Products a non-live version has no current features for."""
+    table = _version_table(tag)
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute(f"""SELECT p.* FROM products p
+                      LEFT JOIN {table} f ON f.product_id = p.id
+                      WHERE f.product_id IS NULL OR f.image_url IS NOT p.image_url""")
+        products = [_row_to_product(row) for row in c.fetchall()]
+
+    return products
+
+
+@timed("db_read")
+def load_version_features(tag: str) -> Dict[int, np.ndarray]:
+    """Features stored for a non-live version."""
+    table = _version_table(tag)
+    with reader() as conn:
+        c = conn.cursor()
+
+        c.execute(f"SELECT product_id, features FROM {table}")
+        features = {
+            row[0]: np.frombuffer(row[1], dtype=np.float32).reshape(1, -1)
+            for row in c.fetchall()
+        }
+
+    return features
+
+
+@timed("db_write")
+def save_version_features(tag: str, results: List[Dict[str, Any]]) -> bool:
+    """Save features computed for a non-live version (category and color are left alone)."""
+    if not results:
+        return True
+
+    table = _version_table(tag)
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.executemany(
+            f"""INSERT OR REPLACE INTO {table} (product_id, features, image_url)
+                      VALUES (?, ?, ?)""",
+            [
+                (r["id"], r["features"].astype(np.float32).tobytes(), r["image_url"])
+                for r in results
+            ],
+        )
+
+    return True
+
+
+@timed("db_write")
+def activate_embedding_version(tag: str, min_coverage: float) -> Dict[str, Any]:
+    """Make a version live by swapping its table with product_features.
+
+    Rows for deleted products and for images that changed since they were
+    embedded are dropped first. The switch happens in one transaction and
+    is refused (ValueError) if the version covers less than
+    ``min_coverage`` of the catalog. The previous live version is kept
+    for rollback.
+    """
+    table = _version_table(tag)
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT status, model FROM embedding_versions WHERE tag = ?", (tag,))
+        row = c.fetchone()
+        if row is None:
+            raise ValueError(f"Unknown embedding version: {tag}")
+        status, model = row
+        if status == "live":
+            raise ValueError(f"Embedding version {tag} is already live")
+
+        c.execute(f"""DELETE FROM {table} WHERE product_id NOT IN
+                      (SELECT id FROM products)""")
+        c.execute(f"""DELETE FROM {table} WHERE product_id IN
+                      (SELECT f.product_id FROM {table} f
+                       JOIN products p ON p.id = f.product_id
+                       WHERE f.image_url IS NOT p.image_url)""")
+        c.execute(f"SELECT COUNT(*) FROM {table}")
+        covered = c.fetchone()[0]
+        c.execute("SELECT COUNT(*) FROM products")
+        total = c.fetchone()[0]
+        coverage = covered / total if total else 1.0
+        if coverage < min_coverage:
+            raise ValueError(
+                f"Embedding version {tag} covers {covered}/{total} products "
+                f"({coverage:.1%}), below the required {min_coverage:.1%}"
+            )
+
+        c.execute("SELECT value FROM app_metadata WHERE key = 'embedding_version'")
+        previous = c.fetchone()[0]
+        c.execute(f"ALTER TABLE product_features RENAME TO {_version_table(previous)}")
+        c.execute(f"ALTER TABLE {table} RENAME TO product_features")
+
+        c.execute(
+            "UPDATE embedding_versions SET status = 'retired' WHERE tag = ?", (previous,)
+        )
+        c.execute(
+            """UPDATE embedding_versions SET status = 'live', activated_at = ?
+                     WHERE tag = ?""",
+            (time.time(), tag),
+        )
+        c.executemany(
+            "INSERT OR REPLACE INTO app_metadata (key, value) VALUES (?, ?)",
+            [("embedding_version", tag), ("embedding_model", model)],
+        )
+
+    return {"tag": tag, "previous": previous, "covered": covered, "total": total}
+
+
+@timed("db_write")
+def drop_embedding_version(tag: str):
+    """Delete a non-live version and its features."""
+    table = _version_table(tag)
+    with transaction() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT status FROM embedding_versions WHERE tag = ?", (tag,))
+        row = c.fetchone()
+        if row is None:
+            raise ValueError(f"Unknown embedding version: {tag}")
+        if row[0] == "live":
+            raise ValueError(f"Embedding version {tag} is live")
 
-    conn.commit()
-    conn.close()
+        c.execute(f"DROP TABLE IF EXISTS {table}")
+        c.execute("DELETE FROM embedding_versions WHERE tag = ?", (tag,))
@@ -1,17 +1,32 @@
 import torch
 from transformers import CLIPProcessor, CLIPModel
 from PIL import Image
-from typing import Tuple
+from typing import List, Tuple
 import numpy as np
 import os
+import hashlib
 import logging
+from config import TEXT_FEATURES_CACHE_DIR, IMAGE_DECODE_SIZE
+from model_optimization import ClipImageEncoder, optimize_model
+from metrics import timed
+from profiling import torch_profiled
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _as_features(output) -> torch.Tensor:
+    """Projected embeddings from get_*_features (newer transformers wrap them in an output object)."""
+    if torch.is_tensor(output):
+        return output
+    return output.pooler_output
+
+
 class FashionClassifier:
+    # Tensor cache tag for inputs produced by `preprocess` from `decode_image`
+    TENSOR_TAG = f"clip224-d{IMAGE_DECODE_SIZE}"
+
     _instance = None
     _is_initialized = False
 
@@ -123,78 +138,137 @@ class FashionClassifier:
                 ],
             }
 
+            # Prompts never change, so encode them once
+            self.text_features = self._load_text_features()
+
+            # Image tower with the configured inference optimizations
+            example = torch.from_numpy(self.preprocess([Image.new("RGB", (224, 224))]))
+            self.image_encoder = optimize_model(
+                ClipImageEncoder(self.model),
+                f"clip-vision-{self.model_name.replace('/', '--')}",
+                example,
+            )
+
             self._is_initialized = True
             logger.info("FashionClassifier initialization complete")
 
+    @property
+    def prompts(self) -> List[str]:
+        return [desc for descs in self.category_descriptions.values() for desc in descs]
+
+    def _text_features_path(self) -> str:
+        key = hashlib.sha256(
+            "\n".join([self.model_name] + self.prompts).encode()
+        ).hexdigest()[:16]
+        return os.path.join(TEXT_FEATURES_CACHE_DIR, f"clip_text_{key}.pt")
+
+    def _load_text_features(self) -> torch.Tensor:
+        """Normalized prompt embeddings, read from disk when cached for this model and prompt set."""
+        path = self._text_features_path() if TEXT_FEATURES_CACHE_DIR else None
+        if path and os.path.exists(path):
+            try:
+                text_features = torch.load(path)
+                logger.info(f"Loaded cached text features from {path}")
+                return text_features
+            except Exception as e:
+                logger.error(f"Error loading cached text features: {str(e)}")
+
+        text_features = self.encode_text(self.prompts)
+
+        if path:
+            try:
+                os.makedirs(TEXT_FEATURES_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                torch.save(text_features, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logger.error(f"Error caching text features: {str(e)}")
+        return text_features
+
+    @timed("clip_text_forward")
+    def encode_text(self, texts: List[str]) -> torch.Tensor:
+        """Encode texts with the CLIP text tower into normalized embeddings."""
+        inputs = self.processor(text=texts, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            text_features = _as_features(
+                self.model.get_text_features(
+                    input_ids=inputs["input_ids"].to("cpu").long(),
+                    attention_mask=inputs["attention_mask"].to("cpu").long(),
+                )
+            )
+        return text_features / text_features.norm(dim=-1, keepdim=True)
+
     def predict(self, image: Image.Image) -> Tuple[str, float]:
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images: List[Image.Image]) -> List[Tuple[str, float]]:
+        """Classify several images with one forward pass through the model."""
         try:
-            # Prepare image
-            inputs = self.processor(
-                images=image,
-                text=[
-                    desc
-                    for descs in self.category_descriptions.values()
-                    for desc in descs
-                ],
-                return_tensors="pt",
-                padding=True,
-            )
+            return self.classify(self.embed_images(images))
+        except Exception as e:
+            print(f"Error in prediction: {str(e)}")
+            return [("other", 0.0) for _ in images]
 
-            # Move tensors to CPU and ensure correct types
-            for key in inputs:
-                if torch.is_tensor(inputs[key]):
-                    if key == "pixel_values":
-                        inputs[key] = inputs[key].to("cpu").float()
-                    else:
-                        inputs[key] = inputs[key].to("cpu").long()
-
-            # Process image and text separately
-            with torch.no_grad():
-                # Get image features
-                image_features = self.model.get_image_features(inputs["pixel_values"])
-
-                # Get text features
-                text_features = self.model.get_text_features(
-                    input_ids=inputs["input_ids"],
-                    attention_mask=inputs["attention_mask"],
-                )
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        """Normalized CLIP image embeddings, one row per image."""
+        return self.embed_pixel_values(self.preprocess(images))
 
-                # Normalize features
-                image_features = image_features / image_features.norm(
-                    dim=-1, keepdim=True
-                )
-                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    @timed("preprocess")
+    def preprocess(self, images: List[Image.Image]) -> np.ndarray:
+        """CLIP pixel values for a list of images, shape (N, 3, H, W)."""
+        inputs = self.processor(images=images, return_tensors="np")
+        return inputs["pixel_values"].astype(np.float32)
 
-                # Calculate similarity scores using einsum instead of matmul
-                logit_scale = self.model.logit_scale.exp()
-                similarity = (
-                    torch.einsum("bd,nd->bn", image_features, text_features)
-                    * logit_scale
-                )
+    @timed("clip_forward")
+    @torch_profiled("embed_pixel_values")
+    def embed_pixel_values(self, pixel_values: np.ndarray) -> np.ndarray:
+        """Normalized CLIP image embeddings for preprocessed pixel values."""
+        # Text features are precomputed
+        pixel_values = torch.as_tensor(pixel_values, dtype=torch.float32)
 
-                # Get probabilities
-                probs = torch.nn.functional.softmax(similarity[0], dim=0)
+        with torch.inference_mode():
+            # Get image features
+            image_features = self.image_encoder(pixel_values)
 
-            # Aggregate probabilities for each category
-            category_scores = {}
-            idx = 0
-            for category, descriptions in self.category_descriptions.items():
-                category_probs = probs[idx : idx + len(descriptions)]
-                category_scores[category] = float(torch.max(category_probs))
-                idx += len(descriptions)
+            # Normalize features
+            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
 
-            # Get the best category and its confidence
-            best_category = max(category_scores.items(), key=lambda x: x[1])
+        return image_features.numpy().astype(np.float32)
 
-            # Apply confidence threshold
-            if best_category[1] >= 0.25:
-                return best_category[0], best_category[1]
+    def classify(self, image_features: np.ndarray) -> List[Tuple[str, float]]:
+        """Categories for normalized image embeddings from embed_images."""
+        with torch.inference_mode():
+            image_features = torch.from_numpy(image_features)
 
-            return "other", best_category[1]
+            # Calculate similarity scores using einsum instead of matmul
+            logit_scale = self.model.logit_scale.exp()
+            similarity = (
+                torch.einsum("bd,nd->bn", image_features, self.text_features)
+                * logit_scale
+            )
 
-        except Exception as e:
-            print(f"Error in prediction: {str(e)}")
-            return "other", 0.0
+            # Get probabilities
+            probs = torch.nn.functional.softmax(similarity, dim=-1)
+
+        return [self._best_category(image_probs) for image_probs in probs]
+
+    def _best_category(self, probs: torch.Tensor) -> Tuple[str, float]:
+        # Aggregate probabilities for each category
+        category_scores = {}
+        idx = 0
+        for category, descriptions in self.category_descriptions.items():
+            category_probs = probs[idx : idx + len(descriptions)]
+            category_scores[category] = float(torch.max(category_probs))
+            idx += len(descriptions)
+
+        # Get the best category and its confidence
+        best_category = max(category_scores.items(), key=lambda x: x[1])
+
+        # Apply confidence threshold
+        if best_category[1] >= 0.25:
+            return best_category[0], best_category[1]
+
+        return "other", best_category[1]
 
 
 def create_classifier() -> FashionClassifier:
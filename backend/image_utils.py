@@ -1,29 +1,63 @@
-import torch
-import torchvision.transforms as transforms
-import torchvision.models as models
 from PIL import Image
+import io
+import os
 import hashlib
+import threading
+import numpy as np
+from functools import lru_cache
+from typing import Optional
 from pathlib import Path
 import logging
-from config import IMAGE_CACHE_DIR
+from cache_utils import DiskCache
+from metrics import timed
+from profiling import torch_profiled
+from config import (
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_MAX_BYTES,
+    TENSOR_CACHE_DIR,
+    TENSOR_CACHE_MAX_BYTES,
+    EMBEDDING_MODEL,
+    IMAGE_DECODE_SIZE,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Image transformation
-transform = transforms.Compose(
-    [
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-)
+# Tensor cache tag for inputs produced by `transform` from `decode_image`
+RESNET_TENSOR_TAG = f"resnet224-d{IMAGE_DECODE_SIZE}"
+
+# torch and torchvision are imported on first use, so importing this module
+# (for the caches and hashing helpers) stays cheap at startup
+_model = None
+_model_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_transform():
+    """Image transformation for ResNet inputs."""
+    import torchvision.transforms as transforms
+
+    return transforms.Compose(
+        [
+            transforms.Resize(256),
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+    )
+
+
+@timed("preprocess")
+def transform(image):
+    return get_transform()(image)
 
 
 def get_model():
     """Load the pre-trained ResNet model."""
+    import torch
+    import torchvision.models as models
+
     model = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V1)
     # Remove the classification layer
     model = torch.nn.Sequential(*list(model.children())[:-1])
@@ -31,37 +65,196 @@ def get_model():
     return model
 
 
+@timed("decode")
+def decode_image(data: bytes, size: int = IMAGE_DECODE_SIZE) -> Image.Image:
+    """Decode image bytes to an RGB image whose shortest side is ``size``.
+
+    JPEGs are decoded at reduced scale (``Image.draft``) as close to the
+    target as the codec allows, then resized once. Every model input (the
+    ResNet transform, the CLIP processor, colour thumbnails) is derived from
+    this one buffer, and each starts by downscaling to at most this size.
+    """
+    image = Image.open(io.BytesIO(data))
+    # No-op for formats without reduced-scale decoding
+    image.draft("RGB", (size, size))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    width, height = image.size
+    scale = size / min(width, height)
+    if scale < 1:
+        image = image.resize(
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            Image.BILINEAR,
+            reducing_gap=2.0,
+        )
+    return image
+
+
+def _calibration_batches():
+    """Cached ResNet inputs from the tensor cache, batched for static quantization.
+
+    Empty until ingestion has filled the cache.
+    """
+    import torch
+    from model_optimization import CALIBRATION_BATCHES, CALIBRATION_BATCH_SIZE
+
+    wanted = CALIBRATION_BATCHES * CALIBRATION_BATCH_SIZE
+    suffix = f".{RESNET_TENSOR_TAG}.npy"
+    digests = [
+        entry.name[: -len(suffix)]
+        for entry in os.scandir(tensor_cache.directory)
+        if entry.name.endswith(suffix)
+    ][:wanted]
+    tensors = [get_cached_tensor(digest, RESNET_TENSOR_TAG) for digest in digests]
+    tensors = [tensor for tensor in tensors if tensor is not None]
+    return [
+        torch.from_numpy(np.stack(tensors[i : i + CALIBRATION_BATCH_SIZE]))
+        for i in range(0, len(tensors), CALIBRATION_BATCH_SIZE)
+    ]
+
+
+def load_model():
+    """Shared ResNet model, loaded on first call (None in CLIP embedding mode).
+
+    The configured inference optimizations (see model_optimization) are
+    applied once here.
+    """
+    global _model
+    if EMBEDDING_MODEL != "resnet50":
+        return None
+    with _model_lock:
+        if _model is None:
+            import torch
+            from model_optimization import optimize_model
+
+            _model = optimize_model(
+                get_model(),
+                "resnet50",
+                torch.zeros(1, 3, 224, 224),
+                supports_static=True,
+                calibration_loader=_calibration_batches,
+            )
+    return _model
+
+
 def extract_features(image, model):
     """Extract features from an image using the model."""
-    image_tensor = transform(image).unsqueeze(0)
-    with torch.no_grad():
-        features = model(image_tensor)
-    return features.squeeze().numpy()
+    return extract_features_batch([transform(image)], model)[0]
+
+
+@timed("resnet_forward")
+@torch_profiled("extract_features")
+def extract_features_batch(image_tensors, model):
+    """Extract features for a batch of transformed image tensors (or arrays)."""
+    import torch
+    from model_optimization import prepare_input
+
+    # Cached inputs are read-only memory maps; stacking is their only copy
+    batch = np.stack([np.asarray(t, dtype=np.float32) for t in image_tensors])
+    batch = prepare_input(torch.from_numpy(batch))
+    with torch.inference_mode():
+        features = model(batch)
+    return features.reshape(features.shape[0], -1).numpy()
+
+
+def _image_cache_name(url: str) -> str:
+    return f"{hashlib.md5(url.encode()).hexdigest()}.jpg"
+
+
+def get_cached_image_bytes(url: str) -> Optional[bytes]:
+    """Get the encoded image bytes from cache if they exist, otherwise return None."""
+    try:
+        return image_cache.get_bytes(_image_cache_name(url))
+    except Exception as e:
+        logger.error(f"Error reading cached image: {str(e)}")
+        return None
+
+
+def cache_image_bytes(url: str, data: bytes) -> None:
+    """Save encoded image bytes to cache."""
+    try:
+        image_cache.put_bytes(_image_cache_name(url), data)
+    except Exception as e:
+        logger.error(f"Error caching image: {str(e)}")
 
 
 def get_cached_image(url: str) -> Image.Image:
     """Get image from cache if it exists, otherwise return None."""
-    url_hash = hashlib.md5(url.encode()).hexdigest()
-    cache_path = Path(IMAGE_CACHE_DIR) / f"{url_hash}.jpg"
-
-    if cache_path.exists():
-        try:
-            return Image.open(cache_path).convert("RGB")
-        except Exception as e:
-            logger.error(f"Error loading cached image: {str(e)}")
-            return None
-    return None
+    data = get_cached_image_bytes(url)
+    if data is None:
+        return None
+    try:
+        return decode_image(data)
+    except Exception as e:
+        logger.error(f"Error loading cached image: {str(e)}")
+        return None
 
 
 def cache_image(url: str, image: Image.Image) -> None:
     """Save image to cache."""
     try:
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        cache_path = Path(IMAGE_CACHE_DIR) / f"{url_hash}.jpg"
-        image.save(cache_path, "JPEG")
+        image_cache.write(_image_cache_name(url), lambda f: image.save(f, "JPEG"))
     except Exception as e:
         logger.error(f"Error caching image: {str(e)}")
 
 
-# Initialize model
-model = get_model()
+def content_hash(data: bytes) -> str:
+    """Content address for encoded image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8) -> Optional[int]:
+    """Near-duplicate key that survives re-encoding and resizing.
+
+    The high bits are a 64-bit difference hash (dHash): each records whether
+    a pixel of a small grayscale thumbnail is brighter than its right-hand
+    neighbour. dHash ignores color, so the low 24 bits hold the mean color
+    of each image quadrant, quantized to four levels per channel. Images
+    without structure (every dHash bit equal, as for a solid color) return
+    None; they are not distinctive enough to share search results.
+    """
+    rgb = image.convert("RGB")
+    thumbnail = rgb.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    if not bits.any() or bits.all():
+        return None
+    dhash = int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    color = 0
+    for level in (np.asarray(rgb.resize((2, 2), Image.BOX)) // 64).ravel():
+        color = (color << 2) | int(level)
+    return (dhash << 24) | color
+
+
+def get_cached_tensor(digest: str, tag: str) -> Optional[np.ndarray]:
+    """Preprocessed model input for an image, memory-mapped (read-only) from the tensor cache.
+
+    Entries written as float16 by earlier versions count as misses, so every
+    model input is exactly what preprocessing produces.
+    """
+    path = tensor_cache.lookup(f"{digest}.{tag}.npy")
+    if path is None:
+        return None
+    try:
+        array = np.load(path, mmap_mode="r")
+        return array if array.dtype == np.float32 else None
+    except Exception as e:
+        # Missing (evicted meanwhile) or unreadable entries count as misses
+        logger.error(f"Error loading cached tensor: {str(e)}")
+        return None
+
+
+def cache_tensor(digest: str, tag: str, tensor) -> None:
+    """Save a preprocessed model input to the tensor cache (as float32)."""
+    try:
+        array = np.asarray(tensor, dtype=np.float32)
+        tensor_cache.write(f"{digest}.{tag}.npy", lambda f: np.save(f, array))
+    except Exception as e:
+        logger.error(f"Error caching tensor: {str(e)}")
+
+
+# Cache of downloaded images (keyed by URL) and of model inputs (keyed by content)
+image_cache = DiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+tensor_cache = DiskCache(TENSOR_CACHE_DIR, TENSOR_CACHE_MAX_BYTES)
@@ -0,0 +1,375 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.request import urlopen
+import numpy as np
+from color_classifier import get_dominant_color, get_dominant_colors
+from database import save_processed_products
+from image_utils import (
+    RESNET_TENSOR_TAG,
+    cache_image_bytes,
+    cache_tensor,
+    content_hash,
+    decode_image,
+    extract_features_batch,
+    get_cached_image_bytes,
+    get_cached_tensor,
+    transform,
+)
+from metrics import INGESTION_STAGE_SECONDS
+from config import (
+    INGEST_BATCH_SIZE,
+    INGEST_DOWNLOAD_WORKERS,
+    INGEST_DECODE_WORKERS,
+    INGEST_DOWNLOAD_TIMEOUT,
+    COLOR_METHOD,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+    """Thread-safe busy time and product counts per pipeline stage.
+
+    Every recorded duration is also observed in the ingestion stage histogram
+    exposed at ``/metrics``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float, count: int = 1) -> None:
+        INGESTION_STAGE_SECONDS.observe(stage, seconds)
+        with self._lock:
+            self._seconds[stage] = self._seconds.get(stage, 0.0) + seconds
+            self._counts[stage] = self._counts.get(stage, 0) + count
+
+    def log(self, wall_seconds: float, processed: int) -> None:
+        with self._lock:
+            for stage, seconds in self._seconds.items():
+                count = self._counts[stage]
+                rate = count / seconds if seconds > 0 else float("inf")
+                logger.info(
+                    f"Stage {stage}: {count} products in {seconds:.2f}s busy "
+                    f"({rate:.1f} products/s)"
+                )
+        rate = processed / wall_seconds if wall_seconds > 0 else float("inf")
+        logger.info(
+            f"Ingested {processed} products in {wall_seconds:.2f}s ({rate:.1f} products/s)"
+        )
+
+
+class IngestionProgress:
+    """Thread-safe progress of a background ingestion run, with cancellation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._stopped = threading.Event()
+        self.state = "pending"
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+
+    def start(self, total: int) -> None:
+        with self._lock:
+            self.state = "running"
+            self.total = total
+            self.processed = 0
+            self.failed = 0
+            self._started = time.perf_counter()
+            self._finished = None
+
+    def advance(self, processed: int, failed: int = 0) -> None:
+        with self._lock:
+            self.processed += processed
+            self.failed += failed
+
+    def finish(self, state: str = "done") -> None:
+        with self._lock:
+            self.state = state
+            self._finished = time.perf_counter()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def stop(self) -> None:
+        """End the current run after its batch; unlike cancel(), later runs go ahead."""
+        self._stopped.set()
+
+    def resume(self) -> None:
+        """Let runs go ahead again after stop()."""
+        self._stopped.clear()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or self._stopped.is_set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = 0.0
+            if self._started is not None:
+                elapsed = (self._finished or time.perf_counter()) - self._started
+            rate = self.processed / elapsed if elapsed > 0 else 0.0
+            remaining = self.total - self.processed - self.failed
+            running = self.state == "running"
+            return {
+                "state": self.state,
+                "total": self.total,
+                "processed": self.processed,
+                "failed": self.failed,
+                "elapsed_seconds": elapsed,
+                "products_per_second": rate,
+                "eta_seconds": remaining / rate if running and rate > 0 else None,
+            }
+
+
+def _fetch(product: Dict[str, Any], stats: StageStats) -> bytes:
+    start = time.perf_counter()
+    data = get_cached_image_bytes(product["image_url"])
+    if data is None:
+        with urlopen(product["image_url"], timeout=INGEST_DOWNLOAD_TIMEOUT) as response:
+            data = response.read()
+        cache_image_bytes(product["image_url"], data)
+        stats.record("download", time.perf_counter() - start)
+    else:
+        stats.record("image_cache", time.perf_counter() - start)
+    return data
+
+
+def _prepare(
+    product: Dict[str, Any], data: bytes, with_resnet: bool, classifier, stats: StageStats
+) -> Dict[str, Any]:
+    """Model inputs for one product, decoding the image only when the tensor cache misses.
+
+    The image is also decoded when the product has no colour yet.
+    """
+    start = time.perf_counter()
+    digest = content_hash(data)
+    resnet = get_cached_tensor(digest, RESNET_TENSOR_TAG) if with_resnet else None
+    clip = get_cached_tensor(digest, classifier.TENSOR_TAG)
+
+    image = None
+    if (with_resnet and resnet is None) or clip is None or not product.get("color"):
+        image = decode_image(data)
+        if with_resnet and resnet is None:
+            resnet = transform(image).numpy()
+            cache_tensor(digest, RESNET_TENSOR_TAG, resnet)
+        if clip is None:
+            clip = classifier.preprocess([image])[0]
+            cache_tensor(digest, classifier.TENSOR_TAG, clip)
+        stats.record("decode", time.perf_counter() - start)
+    else:
+        stats.record("tensor_cache", time.perf_counter() - start)
+
+    return {"product": product, "image": image, "resnet": resnet, "clip": clip}
+
+
+def _colors(items: List[Dict[str, Any]], stats: StageStats) -> List[str]:
+    """Dominant colour of each decoded image; items served from cache keep their colour."""
+    start = time.perf_counter()
+    decoded = [i for i, item in enumerate(items) if item["image"] is not None]
+    images = [items[i]["image"] for i in decoded]
+    if COLOR_METHOD == "lut":
+        # Whole batch in one vectorized pass
+        found = get_dominant_colors(images)
+    else:
+        found = [get_dominant_color(image) for image in images]
+
+    colors = [item["product"]["color"] for item in items]
+    for i, color in zip(decoded, found):
+        colors[i] = color
+    stats.record("color", time.perf_counter() - start, len(items))
+    return colors
+
+
+def _load_items(
+    products: List[Dict[str, Any]],
+    fetch_pool: ThreadPoolExecutor,
+    decode_pool: ThreadPoolExecutor,
+    window: int,
+    decode_window: int,
+    with_resnet: bool,
+    classifier,
+    stats: StageStats,
+    progress: IngestionProgress,
+) -> Iterator[Dict[str, Any]]:
+    """Yield prepared items in order, keeping at most `window` downloads in flight.
+
+    Products whose download or decode fails are counted as failed in ``progress``.
+    """
+    remaining = iter(products)
+    fetching = deque()
+    decoding = deque()
+
+    def submit_next_fetch():
+        product = next(remaining, None)
+        if product is not None:
+            fetching.append((product, fetch_pool.submit(_fetch, product, stats)))
+
+    for _ in range(window):
+        submit_next_fetch()
+
+    while fetching or decoding:
+        if fetching:
+            product, future = fetching.popleft()
+            submit_next_fetch()
+            try:
+                data = future.result()
+                decoding.append(
+                    (
+                        product,
+                        decode_pool.submit(
+                            _prepare, product, data, with_resnet, classifier, stats
+                        ),
+                    )
+                )
+            except Exception as e:
+                logger.error(f"Error downloading product {product['id']}: {str(e)}")
+                progress.advance(0, failed=1)
+
+        # Let decodes overlap with downloads, draining once downloads finish
+        while decoding and (len(decoding) > decode_window or not fetching):
+            product, future = decoding.popleft()
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f"Error decoding product {product['id']}: {str(e)}")
+                progress.advance(0, failed=1)
+
+
+def _batched(items: Iterator, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _process_batch(
+    batch: List[Dict[str, Any]],
+    model,
+    classifier,
+    decode_pool: ThreadPoolExecutor,
+    stats: StageStats,
+) -> List[Dict[str, Any]]:
+    # Colour runs on the worker pool while the models run on this thread
+    colors_future = decode_pool.submit(_colors, batch, stats)
+
+    # One CLIP vision pass gives the category (and the embedding in CLIP mode)
+    start = time.perf_counter()
+    clip_features = classifier.embed_pixel_values(
+        np.stack([item["clip"] for item in batch])
+    )
+    categories = classifier.classify(clip_features)
+    stats.record("classify", time.perf_counter() - start, len(batch))
+
+    if model is None:
+        features = clip_features
+    else:
+        start = time.perf_counter()
+        features = extract_features_batch([item["resnet"] for item in batch], model)
+        stats.record("features", time.perf_counter() - start, len(batch))
+
+    colors = colors_future.result()
+
+    return [
+        {
+            "id": item["product"]["id"],
+            "image_url": item["product"]["image_url"],
+            "features": product_features,
+            "category": category,
+            "color": color,
+        }
+        for item, product_features, (category, _), color in zip(
+            batch, features, categories, colors
+        )
+    ]
+
+
+def ingest_products(
+    products: List[Dict[str, Any]],
+    model,
+    classifier,
+    batch_size: int = INGEST_BATCH_SIZE,
+    download_workers: int = INGEST_DOWNLOAD_WORKERS,
+    decode_workers: int = INGEST_DECODE_WORKERS,
+    stats: Optional[StageStats] = None,
+    progress: Optional[IngestionProgress] = None,
+    save: Callable[[List[Dict[str, Any]]], Optional[bool]] = save_processed_products,
+) -> int:
+    """Download, embed, classify and save products in batches.
+
+    Downloads go through the image cache and preprocessed model inputs
+    through the tensor cache, so re-embedding a cached catalog skips both
+    download and decode.
+
+    With ``model`` set to None, similarity features are the classifier's
+    CLIP image embeddings. ``progress`` is updated after every batch, and
+    cancelling it stops the run before the next one. ``save`` stores each
+    batch's results; returning False stops the run. Returns the number of
+    products saved.
+    """
+    stats = stats or StageStats()
+    progress = progress or IngestionProgress()
+    progress.start(len(products))
+    started = time.perf_counter()
+    processed = 0
+    stopped = False
+
+    with ThreadPoolExecutor(download_workers) as fetch_pool, ThreadPoolExecutor(
+        decode_workers
+    ) as decode_pool:
+        loaded = _load_items(
+            products,
+            fetch_pool,
+            decode_pool,
+            2 * download_workers,
+            decode_workers,
+            model is not None,
+            classifier,
+            stats,
+            progress,
+        )
+        for batch in _batched(loaded, batch_size):
+            if progress.cancelled:
+                logger.info("Ingestion cancelled")
+                break
+
+            try:
+                results = _process_batch(batch, model, classifier, decode_pool, stats)
+            except Exception as e:
+                ids = [item["product"]["id"] for item in batch]
+                logger.error(f"Error processing products {ids}: {str(e)}")
+                progress.advance(0, failed=len(batch))
+                continue
+
+            start = time.perf_counter()
+            if save(results) is False:
+                logger.info("Ingestion stopped: results can no longer be saved")
+                stopped = True
+                break
+            stats.record("save", time.perf_counter() - start, len(results))
+
+            processed += len(results)
+            progress.advance(len(results))
+            logger.info(f"Processed {processed}/{len(products)} products")
+
+    if progress.cancelled:
+        progress.finish("cancelled")
+    else:
+        progress.finish("stopped" if stopped else "done")
+    stats.log(time.perf_counter() - started, processed)
+    return processed
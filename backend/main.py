@@ -3,32 +3,91 @@ import os
 # Set tokenizers parallelism before importing any HuggingFace libraries
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import asyncio
+import hashlib
+import orjson
 from typing import List, Optional, Dict, Any
-import json
 from PIL import Image
-import io
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from contextlib import asynccontextmanager
-from urllib.request import urlopen
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
 from database import (
     init_db,
     load_products,
-    save_products,
-    save_product_features,
+    load_products_by_ids,
+    load_product_features_by_ids,
+    load_products_page,
+    get_catalog_version,
+    PRODUCT_FIELDS,
+    load_products_without_features,
+    search_products_text,
+    save_processed_products,
     load_product_features,
-    update_product_attributes,
-    update_product_image_url,
+    load_product_attributes,
+    add_feature_listener,
+    add_attribute_listener,
+    clear_product_features,
+    get_metadata,
+    set_embedding_model,
+    get_live_embedding_version,
+    get_embedding_version_settings,
+    INITIAL_EMBEDDING_VERSION,
+    close_connections,
 )
-from pathlib import Path
-from fashion_classifier import create_classifier
-from color_classifier import get_dominant_color
-from image_utils import get_cached_image, cache_image, extract_features, model
+from image_utils import (
+    extract_features_batch,
+    transform,
+    load_model,
+    image_cache,
+    tensor_cache,
+    content_hash,
+    decode_image,
+    perceptual_hash,
+)
+from vector_index import product_index, remove_index_files, version_index_path
+from ingestion import ingest_products, IngestionProgress
+from catalog_sync import sync_catalog
+from inference import MicroBatcher
+from profiling import (
+    arm_torch_capture,
+    collapsed,
+    get_profile,
+    list_profiles,
+    sample_request,
+    should_profile,
+)
+from cache_utils import LRUCache, ImageQueryCache
+from metrics import (
+    REQUEST_SECONDS,
+    child_pids,
+    collect_timings,
+    process_memory,
+    register_gauge,
+    render_metrics,
+    server_timing_header,
+    timed,
+)
+import time
 import logging
-from config import PRODUCTS_FILE
+from config import (
+    PRODUCTS_FILE,
+    EMBEDDING_MODEL,
+    EMBEDDING_SETTINGS,
+    TEXT_QUERY_CACHE_SIZE,
+    IMAGE_QUERY_CACHE_SIZE,
+    IMAGE_QUERY_CACHE_TTL,
+    IMAGE_RESULT_CACHE_SIZE,
+    IMAGE_RESULT_CACHE_TTL,
+    IMAGE_SEARCH_BATCH_MAX_FILES,
+    SERVER_TIMING,
+    PROFILE_TOKEN,
+    PRODUCTS_PAGE_CACHE_SIZE,
+    INDEX_SYNC_SECONDS,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -36,107 +95,410 @@ logger = logging.getLogger(__name__)
 
 # Initialize the fashion classifier
 fashion_classifier = None
+# Set by preload() when serve.py loads everything before forking workers
+preloaded = False
+# Embedding version held by the resident index (see reindex.py)
+embedding_version = INITIAL_EMBEDDING_VERSION
+# Held for a whole ingestion run, so runs for different versions never overlap
+ingestion_lock = asyncio.Lock()
+
+
+def _features_batch(images: List[Image.Image]) -> List[np.ndarray]:
+    if EMBEDDING_MODEL == "clip":
+        return list(fashion_classifier.embed_images(images))
+    return list(
+        extract_features_batch([transform(image) for image in images], load_model())
+    )
+
+
+def _text_embeddings_batch(texts: List[str]) -> List[np.ndarray]:
+    return list(fashion_classifier.encode_text(texts).numpy())
+
+
+# Concurrent requests share batched forward passes off the event loop
+feature_batcher = MicroBatcher("features", _features_batch)
+text_batcher = MicroBatcher("text", _text_embeddings_batch)
+
+# Recent semantic-search query embeddings
+query_embedding_cache = LRUCache(TEXT_QUERY_CACHE_SIZE)
+
+# Serialized /api/products pages keyed by catalog version and query
+products_page_cache = LRUCache(PRODUCTS_PAGE_CACHE_SIZE)
+
+# Repeated and near-duplicate image-search uploads
+image_query_cache = ImageQueryCache(
+    IMAGE_QUERY_CACHE_SIZE,
+    IMAGE_RESULT_CACHE_SIZE,
+    embedding_ttl=IMAGE_QUERY_CACHE_TTL,
+    results_ttl=IMAGE_RESULT_CACHE_TTL,
+)
+
+
+# Startup runs in the background; these report how far it has got
+readiness = {"models": False, "index": False, "error": None}
+ingestion_progress = IngestionProgress()
+
+# Scraped at /metrics alongside the stage latency histograms
+register_gauge(
+    "batcher_queue_depth",
+    "Inputs waiting for a batched forward pass.",
+    lambda: {
+        batcher.name: batcher.stats()["queue_depth"]
+        for batcher in (feature_batcher, text_batcher)
+    },
+    label="batcher",
+)
+register_gauge(
+    "cache_hit_ratio",
+    "Hit rate of each cache since startup.",
+    lambda: {
+        "images": image_cache.stats()["hit_rate"],
+        "tensors": tensor_cache.stats()["hit_rate"],
+        "image_query_exact": image_query_cache.stats()["exact"]["hit_rate"],
+        "image_query_near_duplicate": image_query_cache.stats()["near_duplicate"]["hit_rate"],
+        "text_query": query_embedding_cache.stats()["hit_rate"],
+    },
+    label="cache",
+)
+register_gauge("index_size", "Products in the similarity index.", lambda: len(product_index))
+register_gauge(
+    "process_memory_bytes",
+    "Memory of the worker serving the scrape.",
+    process_memory,
+    label="kind",
+)
+register_gauge(
+    "ingestion_products",
+    "Products in the current ingestion run, by outcome.",
+    lambda: {
+        "total": ingestion_progress.total,
+        "processed": ingestion_progress.processed,
+        "failed": ingestion_progress.failed,
+    },
+    label="state",
+)
 
 
 async def initialize_models():
     """Initialize all ML models before starting product processing."""
     global fashion_classifier
+    # Imported here so torch and transformers load after the API is up
+    from fashion_classifier import create_classifier
+
     logger.info("Initializing fashion classifier...")
-    fashion_classifier = create_classifier()
+    fashion_classifier = await asyncio.to_thread(create_classifier)
     logger.info("Fashion classifier initialized successfully")
+    await asyncio.to_thread(load_model)
 
 
-async def get_product_category(image: Image.Image) -> Dict[str, Any]:
-    """Get the product category using the fashion classifier."""
-    global fashion_classifier
-
-    try:
-        # Get prediction from the classifier
-        logger.info("Getting prediction from fashion classifier")
-        category, confidence = fashion_classifier.predict(image)
-        logger.info(f"Predicted category: {category} with confidence: {confidence}")
-        return {"category": category, "confidence": confidence}
-    except Exception as e:
-        logger.error(f"Error in fashion classification: {str(e)}", exc_info=True)
+def _require_models():
+    """Reject requests that need the models or the index before they are loaded."""
+    if not (readiness["models"] and readiness["index"]):
         raise HTTPException(
-            status_code=500, detail=f"Error in fashion classification: {str(e)}"
+            status_code=503,
+            detail="Models are still loading",
+            headers={"Retry-After": "5"},
         )
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    print("\nStarting application initialization...")
+def migrate_embeddings():
+    """Drop stored features computed by a different embedding model so they are re-embedded.
 
-    try:
-        # Initialize database
-        init_db()
-
-        # Initialize ML models first
-        print("Initializing ML models...")
-        await initialize_models()
-        print("ML models initialized successfully")
-
-        print("\nStarting product processing...")
-        # Load products from database
-        json_products = load_products_json()
-        # json_products = json_products[:5]
-        save_products(json_products)
-        products = load_products()
-        print(f"Total products to process: {len(products)}")
+    Versions activated with reindex.py are never dropped: serving one with
+    a different EMBEDDING_MODEL is an error.
+    """
+    stored_model = get_metadata("embedding_model", "resnet50")
+    if stored_model != EMBEDDING_MODEL:
+        if embedding_version != INITIAL_EMBEDDING_VERSION:
+            raise RuntimeError(
+                f"Live embedding version {embedding_version} uses {stored_model}; set "
+                f"EMBEDDING_MODEL={stored_model} or activate a {EMBEDDING_MODEL} "
+                "version with reindex.py"
+            )
+        logger.info(
+            f"Embedding model changed from {stored_model} to {EMBEDDING_MODEL}, "
+            "re-embedding catalog"
+        )
+        clear_product_features()
+        remove_index_files(version_index_path(embedding_version))
+    set_embedding_model(EMBEDDING_MODEL)
 
-        # Load existing product features
-        product_features = load_product_features()
 
-        # Process each product
-        for product in products:
-            print(f"\nProcessing product {product['id']}: {product['name']}")
+def load_product_index(product_features: Dict[int, np.ndarray], path: str):
+    """Load the persisted similarity index and bring it in line with the database."""
+    if os.path.exists(path):
+        try:
+            product_index.load(path)
+        except Exception as e:
+            logger.error(f"Error loading product index, rebuilding: {str(e)}")
+            product_index.build(product_features)
+            return
+    else:
+        product_index.build(product_features)
+        return
 
-            # Check if product features already exist
-            if product["id"] not in product_features:
-                try:
-                    image = get_cached_image(product["image_url"])
-
-                    if image is None:
-                        print(f"- Downloading image")
-                        with urlopen(product["image_url"]) as response:
-                            image = Image.open(response).convert("RGB")
-                    else:
-                        print("- Using cached image")
-
-                    # Extract features for similarity search
-                    print("- Extracting features for similarity search")
-                    features = extract_features(image, model)
-                    product_features[product["id"]] = features
-
-                    # Infer category and color
-                    category_result = await get_product_category(image)
-                    color = get_dominant_color(image)
-
-                    print(
-                        f"- Detected category: {category_result['category']}, color: {color}"
-                    )
+    # Apply only the differences since the index was saved
+    for product_id in set(product_index.ids) - set(product_features):
+        product_index.remove(product_id)
+    for product_id, features in product_features.items():
+        if product_id not in product_index:
+            product_index.upsert(product_id, features)
 
-                    # Update product attributes
-                    print("- Updating product attributes in database")
-                    update_product_attributes(
-                        product["id"], category_result["category"], color
-                    )
 
-                    # Save features to database
-                    print("- Saving features to database")
-                    save_product_features(product["id"], features)
+def prepare_index() -> List[Dict[str, Any]]:
+    """Load stored features into the search index and return products still to ingest."""
+    global embedding_version
+    # Load existing product features and build the resident search index
+    embedding_version = get_live_embedding_version()
+    migrate_embeddings()
+    product_features = load_product_features()
+    load_product_index(product_features, version_index_path(embedding_version))
+    add_feature_listener(product_index.upsert)
+    # Category, color and price for filtered search
+    product_index.set_attributes_many(load_product_attributes())
+    add_attribute_listener(product_index.set_attributes)
 
-                    print(f"✓ Successfully processed product {product['id']}")
+    pending = load_products_without_features()
+    logger.info(f"Products already processed: {len(product_features)}")
+    logger.info(f"Total products to process: {len(pending)}")
+    return pending
 
-                except Exception as e:
-                    print(f"✗ Error processing product {product['id']}: {str(e)}")
-            else:
-                print(f"- Product {product['id']} already processed, skipping")
 
-        print("\nProduct processing completed!")
-        yield
+def switch_embedding_version(version: str) -> List[Dict[str, Any]]:
+    """Serve a newly activated embedding version and return products still to ingest.
+
+    The version's saved index is loaded in place, so searches keep running
+    throughout and see either the old or the new vectors.
+    """
+    global embedding_version
+    product_features = load_product_features()
+    load_product_index(product_features, version_index_path(version))
+    product_index.set_attributes_many(load_product_attributes())
+    embedding_version = version
+    image_query_cache.clear()
+    logger.info(f"Serving embedding version {version} ({len(product_features)} products)")
+    return load_products_without_features()
+
+
+def refresh_index() -> List[Dict[str, Any]]:
+    """Bring an inherited index up to date and return products still to ingest.
+
+    A worker forked (or restarted) by serve.py holds the index as it was at
+    preload time; the saved file and the database may have moved on since.
+    Once another version is live, only the file is re-loaded and the
+    switch is left to watch_embedding_version.
+    """
+    path = version_index_path(embedding_version)
+    if get_live_embedding_version() != embedding_version:
+        if os.path.exists(path):
+            product_index.load(path)
+        return []
+    load_product_index(load_product_features(), path)
+    product_index.set_attributes_many(load_product_attributes())
+    return load_products_without_features()
+
+
+def _worker_id() -> Optional[int]:
+    """This worker's number under serve.py, or None when serving in one process."""
+    worker = os.environ.get("SERVE_WORKER_ID")
+    return None if worker is None else int(worker)
+
+
+def preload():
+    """Load the catalog, models and index before serve.py forks its workers.
+
+    Workers inherit the model weights copy-on-write. The index is saved and
+    re-loaded memory-mapped, so every worker reads the same vectors from the
+    page cache. Database connections are closed; workers open their own.
+    """
+    global fashion_classifier, preloaded
+    from fashion_classifier import create_classifier
+    from model_optimization import configure_threads
+
+    # Forward passes run while loading (text features, quantization exports).
+    # A child forked after multithreaded torch work hangs on its first op,
+    # so keep torch single-threaded here; each worker sets its own count.
+    configure_threads(1, force=True)
+    init_db()
+    sync_catalog(PRODUCTS_FILE)
+    fashion_classifier = create_classifier()
+    load_model()
+    readiness["models"] = True
+
+    prepare_index()
+    product_index.save(version_index_path(embedding_version))
+    product_index.load(version_index_path(embedding_version))
+    readiness["index"] = True
+    close_connections()
+    preloaded = True
+
+
+async def run_startup():
+    """Load models and the index, then ingest new products, while the API serves.
+
+    Under serve.py, models and the index are already loaded and only the
+    first worker ingests.
+    """
+    try:
+        if preloaded:
+            pending = await asyncio.to_thread(refresh_index)
+        else:
+            logger.info("Initializing ML models...")
+            await initialize_models()
+            readiness["models"] = True
+            logger.info("ML models initialized successfully")
+
+            pending = await asyncio.to_thread(prepare_index)
+            readiness["index"] = True
+
+        if _worker_id() not in (None, 0):
+            ingestion_progress.finish("delegated")
+            return
+
+        async with ingestion_lock:
+            await ingest_pending(pending)
     except Exception as e:
-        yield
+        readiness["error"] = str(e)
+        ingestion_progress.finish("failed")
+        logger.error(f"Error during startup: {str(e)}", exc_info=True)
+
+
+async def ingest_pending(pending: List[Dict[str, Any]]):
+    """Embed products without features in batches, then save the index.
+
+    Batches are only saved while the embedding version they were computed
+    for is still live.
+    """
+    version = embedding_version
+    logger.info("Starting product processing...")
+    await asyncio.to_thread(
+        ingest_products,
+        pending,
+        load_model(),
+        fashion_classifier,
+        progress=ingestion_progress,
+        save=lambda results: save_processed_products(results, embedding_version=version),
+    )
+    logger.info("Product processing completed")
+    if embedding_version == version:
+        await asyncio.to_thread(product_index.save, version_index_path(version))
+
+
+async def watch_embedding_version():
+    """Switch to an embedding version activated by reindex.py, without a restart.
+
+    Versions built with different EMBEDDING_SETTINGS than this process's
+    (the model, decode size or model optimizations) don't match its query
+    embeddings; those need a restart with the matching configuration. Until
+    then, re-ranking reads the served version's full vectors from its
+    retired table. A running ingestion is stopped (after its current batch)
+    before switching.
+    """
+    refused = None
+    while True:
+        await asyncio.sleep(INDEX_SYNC_SECONDS)
+        if not readiness["index"]:
+            continue
+        try:
+            live = await asyncio.to_thread(get_live_embedding_version)
+            if live == embedding_version:
+                if refused is not None:
+                    # Rolled back: this version's vectors are live again
+                    product_index.rerank_loader = load_product_features_by_ids
+                    refused = None
+                continue
+            if live == refused:
+                continue
+            settings = await asyncio.to_thread(get_embedding_version_settings, live)
+            if settings is None:
+                # Versions not built by reindex.py only record their model
+                model = await asyncio.to_thread(get_metadata, "embedding_model")
+                settings = {"EMBEDDING_MODEL": model}
+            mismatched = [
+                f"{key}={value}"
+                for key, value in settings.items()
+                if EMBEDDING_SETTINGS.get(key) != value
+            ]
+            if mismatched:
+                refused = live
+                product_index.rerank_loader = partial(
+                    load_product_features_by_ids, version=embedding_version
+                )
+                logger.error(
+                    f"Embedding version {live} was built with {', '.join(mismatched)}; "
+                    f"still serving {embedding_version} until restarted with those settings"
+                )
+                continue
+
+            ingestion_progress.stop()
+            async with ingestion_lock:
+                ingestion_progress.resume()
+                pending = await asyncio.to_thread(switch_embedding_version, live)
+                product_index.rerank_loader = load_product_features_by_ids
+                refused = None
+                if _worker_id() in (None, 0):
+                    await ingest_pending(pending)
+        except Exception as e:
+            logger.error(f"Error switching embedding version: {str(e)}", exc_info=True)
+
+
+async def sync_index_file():
+    """Share index changes between serve.py workers through the index file.
+
+    The ingesting worker saves the index when it has changed; the others
+    re-load (memory-map) it when the file is replaced.
+    """
+    ingesting = _worker_id() == 0
+    saved_version = product_index.version
+    path = version_index_path(embedding_version)
+    # Re-load on the first pass: the file may have changed since startup read it
+    loaded = (path, None)
+    while True:
+        await asyncio.sleep(INDEX_SYNC_SECONDS)
+        try:
+            path = version_index_path(embedding_version)
+            if ingesting:
+                if product_index.version != saved_version:
+                    saved_version = product_index.version
+                    await asyncio.to_thread(product_index.save, path)
+            elif os.path.exists(path):
+                mtime = os.path.getmtime(path)
+                if (path, mtime) != loaded:
+                    await asyncio.to_thread(product_index.load, path)
+                    loaded = (path, mtime)
+        except Exception as e:
+            logger.error(f"Error syncing the index file: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Starting application initialization...")
+
+    if not preloaded:
+        try:
+            # Initialize database and the catalog, so text search works right away
+            init_db()
+            sync_catalog(PRODUCTS_FILE)
+        except Exception as e:
+            logger.error(f"Error during startup: {str(e)}", exc_info=True)
+
+    feature_batcher.start()
+    text_batcher.start()
+    startup_task = asyncio.create_task(run_startup())
+    sync_task = asyncio.create_task(sync_index_file()) if preloaded else None
+    version_task = asyncio.create_task(watch_embedding_version())
+    yield
+    # Finish the current ingestion batch, then stop
+    ingestion_progress.cancel()
+    await startup_task
+    # Let an ingestion started by a version switch finish its batch too
+    async with ingestion_lock:
+        version_task.cancel()
+    if sync_task is not None:
+        sync_task.cancel()
+    await feature_batcher.stop()
+    await text_batcher.stop()
+    close_connections()
 
 
 app = FastAPI(title="Visual Search API", lifespan=lifespan)
@@ -148,111 +510,431 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Profile-Id"],
 )
 
-# Create data directory if it doesn't exist
-os.makedirs("data", exist_ok=True)
 
-# Sample products data
-PRODUCTS_FILE = "data/products.json"
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Record request latency per route, and add Server-Timing when enabled.
+
+    Requests picked for profiling (other than the profile endpoints' own)
+    are sampled and get an X-Profile-Id header.
+    """
+    start = time.perf_counter()
+    profile = should_profile(request.headers.get("X-Profile"))
+    profiler = (
+        sample_request(f"{request.method} {request.url.path}")
+        if profile and not request.url.path.startswith("/admin/")
+        else nullcontext()
+    )
+    with profiler as profile_id:
+        if SERVER_TIMING:
+            with collect_timings() as timings:
+                response = await call_next(request)
+            response.headers["Server-Timing"] = server_timing_header(
+                timings, time.perf_counter() - start
+            )
+        else:
+            response = await call_next(request)
+    if profile_id is not None:
+        response.headers["X-Profile-Id"] = str(profile_id)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(getattr(route, "path", "unmatched"), time.perf_counter() - start)
+    return response
+
+
+def _json(content: Any) -> JSONResponse:
+    """Serialize a response body, timed as its own stage."""
+    with timed("serialize"):
+        return JSONResponse(content=jsonable_encoder(content))
+
 
 # Initialize with sample data if file doesn't exist
 if not os.path.exists(PRODUCTS_FILE):
     raise FileNotFoundError(f"File {PRODUCTS_FILE} not found")
 
 
-# Load products.json
-def load_products_json():
-    with open(PRODUCTS_FILE, "r") as f:
-        return json.load(f)
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Ready once models and the index are loaded; ingestion may still be running."""
+    ready = readiness["models"] and readiness["index"]
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "starting",
+            **readiness,
+            "ingestion": ingestion_progress.state,
+            "embedding_version": embedding_version,
+        },
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def _require_profiling(request: Request):
+    """Admit only requests carrying the profiling token."""
+    if not PROFILE_TOKEN or request.headers.get("X-Profile") != PROFILE_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiling requires PROFILE_TOKEN")
 
 
-# Feature cache
-product_features = {}
+@app.get("/admin/profiles")
+async def get_profiles(request: Request):
+    """Kept request and torch profiles, newest first."""
+    _require_profiling(request)
+    return list_profiles()
+
+
+@app.get("/admin/profiles/latest")
+async def get_latest_profile(request: Request, kind: Optional[str] = None):
+    """Collapsed stacks of the newest profile (of ``kind`` "request" or "torch")."""
+    _require_profiling(request)
+    profile = get_profile(kind=kind)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No profile captured yet")
+    return PlainTextResponse(collapsed(profile), headers={"X-Profile-Id": str(profile["id"])})
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile_stacks(request: Request, profile_id: int):
+    """Collapsed stacks of one profile, ready for flamegraph.pl or speedscope."""
+    _require_profiling(request)
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(collapsed(profile))
+
+
+@app.post("/admin/profiles/torch")
+async def capture_torch_profile(request: Request, passes: int = 1):
+    """Capture the next model calls (extract_features, embed_pixel_values) with torch.profiler."""
+    _require_profiling(request)
+    arm_torch_capture(passes)
+    return {"armed": passes}
+
+
+@app.get("/api/workers")
+async def get_workers():
+    """Memory of every serving worker (or of this process when serving alone)."""
+    worker = _worker_id()
+    pids = child_pids(os.getppid()) if worker is not None else [os.getpid()]
+    workers = []
+    for pid in pids:
+        try:
+            workers.append({"pid": pid, "current": pid == os.getpid(), **process_memory(pid)})
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return {"worker": worker, "workers": workers}
+
+
+@app.get("/api/ingestion/progress")
+async def get_ingestion_progress():
+    return ingestion_progress.snapshot()
+
+
+def _products_page(cursor: Optional[int], limit: Optional[int], fields: tuple) -> tuple:
+    """Serialized body, ETag and next cursor of one /api/products page."""
+    products = load_products_page(cursor, limit, fields)
+    next_cursor = products[-1]["id"] if limit is not None and len(products) == limit else None
+    with timed("serialize"):
+        if "id" not in fields:
+            products = [{f: p[f] for f in fields} for p in products]
+        body = orjson.dumps(products)
+    etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+    return body, etag, next_cursor
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
 
 
 @app.get("/api/products")
-async def get_products():
-    return load_products()
+async def get_products(
+    request: Request,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    """Catalog products in id order.
+
+    ``limit`` pages the catalog: the ``X-Next-Cursor`` response header is
+    the ``cursor`` of the next page (absent on the last one). ``fields`` is
+    a comma-separated subset of the product fields. Pages are kept
+    pre-serialized until the catalog changes, and an ``If-None-Match`` that
+    matches the page's ``ETag`` gets a 304.
+    """
+    selected = PRODUCT_FIELDS
+    if fields:
+        selected = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = sorted(set(selected) - set(PRODUCT_FIELDS))
+        if unknown or not selected:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}; choose from {', '.join(PRODUCT_FIELDS)}",
+            )
+    if limit is not None and limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+
+    key = (get_catalog_version(), cursor, limit, selected)
+    page = products_page_cache.get(key)
+    if page is None:
+        page = await asyncio.to_thread(_products_page, cursor, limit, selected)
+        products_page_cache.put(key, page)
+    body, etag, next_cursor = page
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/inference/stats")
+async def get_inference_stats():
+    return {
+        "features": feature_batcher.stats(),
+        "text": text_batcher.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+    }
+
+
+def _lexical_score(product: Dict[str, Any], query: str) -> float:
+    """1.0 for a substring match on the name, else the fraction of query words found."""
+    query = query.lower()
+    if query in product["name"].lower():
+        return 1.0
+    words = query.split()
+    if not words:
+        return 0.0
+    text = " ".join(
+        str(product.get(field) or "") for field in ("name", "category", "color")
+    ).lower()
+    return sum(word in text for word in words) / len(words)
+
+
+async def _query_embedding(query: str) -> np.ndarray:
+    """CLIP text embedding for a search query, served from an LRU cache when possible."""
+    key = query.strip().lower()
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        with timed("text_embedding"):
+            embedding = await text_batcher.submit(key)
+        query_embedding_cache.put(key, embedding)
+    return embedding
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return {
+        "images": image_cache.stats(),
+        "tensors": tensor_cache.stats(),
+        "image_queries": image_query_cache.stats(),
+    }
 
 
 @app.get("/api/search/text")
-async def search_by_text(query: str):
-    products = load_products()
+async def search_by_text(
+    query: str,
+    mode: str = "lexical",
+    limit: Optional[int] = None,
+    offset: int = 0,
+    alpha: float = 0.5,
+):
+    if mode not in ("lexical", "semantic", "hybrid"):
+        raise HTTPException(status_code=400, detail=f"Unknown search mode: {mode}")
+
     if not query:
-        return products
+        products = load_products()
+        end = None if limit is None else offset + limit
+        return _json(products[offset:end])
+
+    if mode == "lexical":
+        # Ranked full-text match on name, category and color
+        return _json(search_products_text(query, limit=limit, offset=offset))
+
+    if EMBEDDING_MODEL != "clip":
+        raise HTTPException(
+            status_code=400,
+            detail="Semantic search requires the CLIP embedding index (EMBEDDING_MODEL=clip)",
+        )
+    _require_models()
+
+    k = limit or 50
+    matches = product_index.search(await _query_embedding(query), k=offset + k)
+
+    if mode == "semantic":
+        matches = matches[offset:]
+        products = load_products_by_ids([product_id for product_id, _ in matches])
+        return _json(
+            [
+                {**products[product_id], "similarity": score}
+                for product_id, score in matches
+                if product_id in products
+            ]
+        )
+
+    # Hybrid: blend min-max scaled semantic scores with lexical matches
+    semantic = dict(matches)
+    if semantic:
+        low, high = min(semantic.values()), max(semantic.values())
+        spread = (high - low) or 1.0
+        semantic = {pid: (score - low) / spread for pid, score in semantic.items()}
+
+    # Candidates are the semantic hits plus the best full-text matches
+    products = {p["id"]: p for p in search_products_text(query, limit=offset + k)}
+    missing = [pid for pid in semantic if pid not in products]
+    products.update(load_products_by_ids(missing))
+
+    scored = [
+        (p, alpha * semantic.get(pid, 0.0) + (1 - alpha) * _lexical_score(p, query))
+        for pid, p in products.items()
+    ]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return _json(
+        [{**product, "score": score} for product, score in scored[offset : offset + k]]
+    )
+
+
+def _ranking_cache(
+    similarity_threshold: float,
+    k: Optional[int],
+    category: Optional[List[str]],
+    color: Optional[List[str]],
+    min_price: Optional[float],
+    max_price: Optional[float],
+):
+    """Index filters for an image search, and result-cache lookup and store for it.
+
+    Both image-search endpoints key cached rankings here, so a ranking
+    cached by one is found by the other.
+    """
+    filters = {
+        "categories": tuple(sorted(category)) if category else None,
+        "colors": tuple(sorted(color)) if color else None,
+        "min_price": min_price,
+        "max_price": max_price,
+    }
+    params = (similarity_threshold, k) + tuple(filters.values())
+    version = product_index.version
 
-    # Simple case-insensitive search in product names
-    results = [p for p in products if query.lower() in p["name"].lower()]
-    return results
+    def lookup(phash: Optional[int], embedded: bool):
+        return image_query_cache.get_results(phash, params, version, embedded=embedded)
+
+    def store(phash: Optional[int], matches, seconds: float) -> None:
+        image_query_cache.put_results(phash, params, version, matches, seconds)
+
+    return filters, lookup, store
 
 
 @app.post("/api/search/image-search")
 async def search_by_image(
-    file: UploadFile = File(...), similarity_threshold: float = 0.5
+    file: UploadFile = File(...),
+    similarity_threshold: float = 0.5,
+    top_k: Optional[int] = 50,
+    category: Optional[List[str]] = Query(None),
+    color: Optional[List[str]] = Query(None),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
 ):
+    """Products most similar to the uploaded image, best first.
+
+    ``category`` and ``color`` may be repeated to allow several values;
+    filters are applied inside the index, so only matching products are
+    scored. ``limit`` (default ``top_k``) and ``offset`` page the results.
+    """
+    _require_models()
     try:
         # Validate file type
         if not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
 
-        # Read and process the uploaded image
+        # Read the upload; a byte-identical repeat reuses its embedding
         contents = await file.read()
-        try:
-            image = Image.open(io.BytesIO(contents)).convert("RGB")
-        except Exception as e:
-            logger.error(f"Error opening image: {str(e)}")
-            raise HTTPException(status_code=400, detail="Invalid image file")
-
-        # Extract features from the uploaded image
-        try:
-            query_features = extract_features(image, model)
-        except Exception as e:
-            logger.error(f"Error extracting features: {str(e)}")
-            raise HTTPException(
-                status_code=500, detail="Error processing image features"
-            )
+        digest = content_hash(contents)
+        cached = image_query_cache.get_embedding(digest)
 
-        # Compare with pre-computed product features
-        products = load_products()
-        similarities = []
+        if cached is None:
+            try:
+                image = decode_image(contents)
+            except Exception as e:
+                logger.error(f"Error opening image: {str(e)}")
+                raise HTTPException(status_code=400, detail="Invalid image file")
+            query_features, phash = None, perceptual_hash(image)
+        else:
+            query_features, phash = cached
 
-        # Load features from database
-        try:
-            product_features = load_product_features()
-        except Exception as e:
-            logger.error(f"Error loading product features: {str(e)}")
-            raise HTTPException(
-                status_code=500, detail="Error loading product database"
-            )
+        # Near-duplicates of a recent upload reuse its ranking
+        k = limit if limit is not None else top_k
+        search_k = None if k is None else offset + k
+        filters, lookup, store = _ranking_cache(
+            similarity_threshold, search_k, category, color, min_price, max_price
+        )
+        matches = lookup(phash, embedded=query_features is not None)
 
-        for product in products:
-            if product["id"] in product_features:
+        if matches is None:
+            if query_features is None:
+                # Extract features from the uploaded image
+                start = time.perf_counter()
                 try:
-                    # Ensure features are properly shaped numpy arrays
-                    query_feat = np.array(query_features).reshape(1, -1)
-                    prod_feat = np.array(product_features[product["id"]]).reshape(1, -1)
-
-                    similarity = cosine_similarity(query_feat, prod_feat)[0][0]
-                    if similarity >= similarity_threshold:
-                        similarities.append((product, float(similarity)))
+                    # Queue wait plus the batched forward pass
+                    with timed("features"):
+                        query_features = await feature_batcher.submit(image)
                 except Exception as e:
-                    logger.error(
-                        f"Error calculating similarity for product {product['id']}: {str(e)}"
+                    logger.error(f"Error extracting features: {str(e)}")
+                    raise HTTPException(
+                        status_code=500, detail="Error processing image features"
                     )
-                    continue
+                image_query_cache.put_embedding(
+                    digest, query_features, phash, time.perf_counter() - start
+                )
+
+            # Rank against the resident embedding index
+            start = time.perf_counter()
+            try:
+                matches = product_index.search(
+                    query_features,
+                    k=search_k,
+                    threshold=similarity_threshold,
+                    **filters,
+                )
+            except Exception as e:
+                logger.error(f"Error searching product index: {str(e)}")
+                raise HTTPException(
+                    status_code=500, detail="Error searching product index"
+                )
+            store(phash, matches, time.perf_counter() - start)
 
-        # Sort by similarity (highest first)
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        matches = matches[offset:search_k]
 
-        # Return the top results
-        results = [item[0] for item in similarities]
+        # Load only the matched products, keeping the ranking order
+        products = load_products_by_ids([product_id for product_id, _ in matches])
+        results = [
+            {**products[product_id], "similarity": score}
+            for product_id, score in matches
+            if product_id in products
+        ]
 
         if not results:
             logger.info("No similar products found")
-            return []
 
-        return results
+        return _json(results)
 
     except HTTPException as he:
         raise he
@@ -263,6 +945,134 @@ async def search_by_image(
         )
 
 
+@app.post("/api/search/image-search/batch")
+async def search_by_images(
+    files: List[UploadFile] = File(...),
+    similarity_threshold: float = 0.5,
+    top_k: Optional[int] = 50,
+    category: Optional[List[str]] = Query(None),
+    color: Optional[List[str]] = Query(None),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+):
+    """Products most similar to each of several uploaded images.
+
+    The uploads are decoded concurrently, embedded together in batched
+    forward passes and scored against the index in one matrix product.
+    Returns one entry per upload, in order, with its ``filename`` and
+    ``results`` (as from ``/api/search/image-search``).
+    """
+    _require_models()
+    if len(files) > IMAGE_SEARCH_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {IMAGE_SEARCH_BATCH_MAX_FILES} images per request",
+        )
+    for file in files:
+        if not file.content_type.startswith("image/"):
+            raise HTTPException(
+                status_code=400, detail=f"File must be an image: {file.filename}"
+            )
+
+    try:
+        # Byte-identical repeats reuse their embeddings
+        contents = [await file.read() for file in files]
+        digests = [content_hash(data) for data in contents]
+        cached = [image_query_cache.get_embedding(digest) for digest in digests]
+        embeddings = [None if entry is None else entry[0] for entry in cached]
+        phashes = [None if entry is None else entry[1] for entry in cached]
+
+        # Decode the rest concurrently
+        to_decode = [i for i, entry in enumerate(cached) if entry is None]
+        decoded = await asyncio.gather(
+            *(asyncio.to_thread(decode_image, contents[i]) for i in to_decode),
+            return_exceptions=True,
+        )
+        images = {}
+        for i, image in zip(to_decode, decoded):
+            if isinstance(image, Exception):
+                logger.error(f"Error opening image {files[i].filename}: {str(image)}")
+                raise HTTPException(
+                    status_code=400, detail=f"Invalid image file: {files[i].filename}"
+                )
+            images[i] = image
+            phashes[i] = perceptual_hash(image)
+
+        # Near-duplicates of recent uploads reuse their rankings
+        filters, lookup, store = _ranking_cache(
+            similarity_threshold, top_k, category, color, min_price, max_price
+        )
+        matches = [
+            lookup(phash, embedded=embeddings[i] is not None)
+            for i, phash in enumerate(phashes)
+        ]
+        to_search = [i for i, found in enumerate(matches) if found is None]
+
+        to_embed = [i for i in to_search if embeddings[i] is None]
+        if to_embed:
+            start = time.perf_counter()
+            try:
+                # Queued together, so they share forward passes
+                with timed("features"):
+                    features = await feature_batcher.submit_many(
+                        [images[i] for i in to_embed]
+                    )
+            except Exception as e:
+                logger.error(f"Error extracting features: {str(e)}")
+                raise HTTPException(
+                    status_code=500, detail="Error processing image features"
+                )
+            seconds = (time.perf_counter() - start) / len(to_embed)
+            for i, vector in zip(to_embed, features):
+                embeddings[i] = vector
+                image_query_cache.put_embedding(digests[i], vector, phashes[i], seconds)
+
+        if to_search:
+            # Rank every remaining query against the index at once
+            start = time.perf_counter()
+            try:
+                found = product_index.search_many(
+                    np.vstack([embeddings[i] for i in to_search]),
+                    k=top_k,
+                    threshold=similarity_threshold,
+                    **filters,
+                )
+            except Exception as e:
+                logger.error(f"Error searching product index: {str(e)}")
+                raise HTTPException(
+                    status_code=500, detail="Error searching product index"
+                )
+            seconds = (time.perf_counter() - start) / len(to_search)
+            for i, query_matches in zip(to_search, found):
+                matches[i] = query_matches
+                store(phashes[i], query_matches, seconds)
+
+        # Load every matched product once
+        products = load_products_by_ids(
+            list({product_id for query_matches in matches for product_id, _ in query_matches})
+        )
+        results = [
+            {
+                "filename": file.filename,
+                "results": [
+                    {**products[product_id], "similarity": score}
+                    for product_id, score in query_matches
+                    if product_id in products
+                ],
+            }
+            for file, query_matches in zip(files, matches)
+        ]
+        return _json(results)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Unexpected error in search_by_images: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error processing request: {str(e)}"
+        )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,215 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Histogram bucket bounds in seconds, from sub-millisecond reads to slow batches
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+PREFIX = "visual_search"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with a single label."""
+
+    def __init__(
+        self, name: str, help: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Per label value: non-cumulative bucket counts (last is +Inf), sum
+        self._counts: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts = self._counts.get(label_value)
+            if counts is None:
+                counts = self._counts[label_value] = [0] * (len(self.buckets) + 1)
+                self._sums[label_value] = 0.0
+            counts[index] += 1
+            self._sums[label_value] += seconds
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for value in sorted(self._counts):
+                label = f'{self.label}="{_escape(value)}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), self._counts[value]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{label}}} {self._sums[value]}")
+                lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time.
+
+    The callback returns a number, or a dict of label value to number.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], Union[float, Dict[str, float]]],
+        label: Optional[str] = None,
+    ):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label = label
+
+    def render(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"Error collecting {self.name}: {str(e)}")
+            return []
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if isinstance(values, dict):
+            for value, number in sorted(values.items()):
+                lines.append(f'{self.name}{{{self.label}="{_escape(str(value))}"}} {float(number)}')
+        else:
+            lines.append(f"{self.name} {float(values)}")
+        return lines
+
+
+# Time spent in each pipeline stage, on both the request and ingestion paths
+STAGE_SECONDS = Histogram(
+    f"{PREFIX}_stage_seconds", "Time spent in each processing stage.", "stage"
+)
+# End-to-end request latency by route template
+REQUEST_SECONDS = Histogram(
+    f"{PREFIX}_request_seconds", "HTTP request latency by route.", "route"
+)
+# Ingestion pipeline stage busy time per batch or product
+INGESTION_STAGE_SECONDS = Histogram(
+    f"{PREFIX}_ingestion_stage_seconds", "Ingestion pipeline stage durations.", "stage"
+)
+
+_histograms = [STAGE_SECONDS, REQUEST_SECONDS, INGESTION_STAGE_SECONDS]
+_gauges: List[Gauge] = []
+
+# Stage timings of the request being handled, when Server-Timing is enabled
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = (
+    contextvars.ContextVar("request_timings", default=None)
+)
+
+
+def register_gauge(
+    name: str,
+    help: str,
+    collect: Callable[[], Union[float, Dict[str, float]]],
+    label: Optional[str] = None,
+) -> None:
+    _gauges.append(Gauge(f"{PREFIX}_{name}", help, collect, label))
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the duration of a block (or, as a decorator, a call) under a stage.
+
+    The duration also goes to the current request's Server-Timing entries
+    when they are being collected.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(stage, seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, seconds))
+
+
+@contextmanager
+def collect_timings() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the stage timings recorded by this context (and threads it starts)."""
+    timings: List[Tuple[str, float]] = []
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    """Format stage timings as a Server-Timing header, summing repeated stages."""
+    durations: Dict[str, float] = {}
+    for stage, seconds in list(timings):
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in durations.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """Memory of a process in bytes, from /proc (Linux).
+
+    ``rss`` counts every resident page, including pages shared with other
+    workers; ``pss`` splits shared pages between the processes mapping
+    them, so the PSS of all workers adds up to their real footprint.
+    """
+    values: Dict[str, int] = {}
+    with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            parts = rest.split()
+            if len(parts) == 2 and parts[1] == "kB":
+                values[key] = int(parts[0]) * 1024
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(parent: int) -> List[int]:
+    """Processes whose parent is ``parent`` (Linux)."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name is in parentheses and may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            continue
+        if int(fields[1]) == parent:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _histograms + _gauges:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
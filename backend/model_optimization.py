@@ -0,0 +1,213 @@
+import os
+import hashlib
+import logging
+import warnings
+import numpy as np
+import torch
+from typing import Callable, List, Optional
+from config import (
+    MODEL_QUANTIZATION,
+    MODEL_COMPILE,
+    MODEL_CHANNELS_LAST,
+    TORCH_NUM_THREADS,
+    MODEL_CACHE_DIR,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Batches of calibration inputs for static quantization
+CALIBRATION_BATCHES = 8
+CALIBRATION_BATCH_SIZE = 8
+
+# Part of the export cache key; bumped when earlier exports must not be reused
+# (2: static exports are no longer calibrated on random inputs)
+EXPORT_FORMAT = 2
+
+_threads_configured = False
+
+
+def configure_threads(num_threads: int = TORCH_NUM_THREADS, force: bool = False) -> int:
+    """Set torch's intra-op thread count (0 uses every available core).
+
+    Only the first call takes effect unless ``force`` is set, as it is for
+    forked serving workers that split the cores between them.
+    """
+    global _threads_configured
+    if force or not _threads_configured:
+        if num_threads <= 0:
+            num_threads = len(os.sched_getaffinity(0))
+        torch.set_num_threads(num_threads)
+        _threads_configured = True
+        logger.info(f"Using {torch.get_num_threads()} intra-op threads for inference")
+    return torch.get_num_threads()
+
+
+def threads_per_worker(workers: int) -> int:
+    """Intra-op threads for each of ``workers`` processes: an equal share of the cores."""
+    if TORCH_NUM_THREADS > 0:
+        return TORCH_NUM_THREADS
+    return max(1, len(os.sched_getaffinity(0)) // workers)
+
+
+def is_optimized() -> bool:
+    return (
+        MODEL_QUANTIZATION != "none" or MODEL_COMPILE != "none" or MODEL_CHANNELS_LAST
+    )
+
+
+class ClipImageEncoder(torch.nn.Module):
+    """CLIP vision tower plus projection as a plain tensor-in, tensor-out module."""
+
+    def __init__(self, clip_model):
+        super().__init__()
+        self.vision_model = clip_model.vision_model
+        self.visual_projection = clip_model.visual_projection
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        pooled = self.vision_model(pixel_values=pixel_values, return_dict=False)[1]
+        return self.visual_projection(pooled)
+
+
+def _cache_path(name: str, example: torch.Tensor, channels_last: bool) -> str:
+    settings = "|".join(
+        [
+            name,
+            str(EXPORT_FORMAT),
+            MODEL_QUANTIZATION,
+            MODEL_COMPILE,
+            str(channels_last),
+            str(tuple(example.shape[1:])),
+            torch.__version__,
+        ]
+    )
+    digest = hashlib.sha256(settings.encode()).hexdigest()[:16]
+    return os.path.join(MODEL_CACHE_DIR, f"{name}-{digest}.pt")
+
+
+def _quantize(
+    model: torch.nn.Module,
+    example: torch.Tensor,
+    static: bool,
+    calibration: Optional[List[torch.Tensor]],
+) -> torch.nn.Module:
+    if static:
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        torch.backends.quantized.engine = "x86"
+        prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), (example,))
+        with torch.inference_mode():
+            for batch in calibration:
+                prepared(batch)
+        return convert_fx(prepared)
+
+    # Dynamic quantization covers Linear layers (weights int8, activations on the fly)
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def optimize_model(
+    model: torch.nn.Module,
+    name: str,
+    example: torch.Tensor,
+    supports_static: bool = False,
+    calibration_loader: Optional[Callable[[], List[torch.Tensor]]] = None,
+) -> torch.nn.Module:
+    """Apply the configured inference optimizations to an eval-mode model.
+
+    Quantized or TorchScript models are exported once as frozen TorchScript
+    under MODEL_CACHE_DIR, keyed by the model name, settings, input shape
+    and torch version, and loaded from there on later starts. Static
+    quantization needs an FX-traceable model (``supports_static``); others
+    fall back to dynamic quantization of Linear layers. ``calibration_loader``
+    returns real input batches for static quantization; while it has none
+    (before the first ingestion fills the tensor cache), dynamic
+    quantization is used and nothing is exported, so a later start can
+    calibrate properly.
+    """
+    configure_threads()
+    if not is_optimized():
+        return model
+
+    # Conv nets benefit from NHWC; transformers only use it for the patch embedding
+    channels_last = MODEL_CHANNELS_LAST and supports_static
+    if channels_last:
+        example = example.contiguous(memory_format=torch.channels_last)
+
+    export = MODEL_QUANTIZATION != "none" or MODEL_COMPILE == "torchscript"
+    path = _cache_path(name, example, channels_last)
+    if export and os.path.exists(path):
+        try:
+            optimized = torch.jit.load(path)
+            logger.info(f"Loaded optimized {name} from {path}")
+            return _compile(optimized)
+        except Exception as e:
+            logger.error(f"Error loading optimized {name}, re-exporting: {str(e)}")
+
+    model = model.eval()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    persist = export
+    if MODEL_QUANTIZATION != "none":
+        static = MODEL_QUANTIZATION == "static" and supports_static
+        if MODEL_QUANTIZATION == "static" and not supports_static:
+            logger.info(f"{name} does not support static quantization, using dynamic")
+        calibration = calibration_loader() if static and calibration_loader else None
+        if static and not calibration:
+            # An export calibrated on made-up inputs would be cached and reused
+            logger.warning(
+                f"No calibration inputs for {name} yet, using dynamic quantization "
+                "without exporting it; restart after ingestion to quantize statically"
+            )
+            static = False
+            persist = False
+        if channels_last and calibration:
+            calibration = [
+                batch.contiguous(memory_format=torch.channels_last)
+                for batch in calibration
+            ]
+        model = _quantize(model, example, static, calibration)
+
+    if export:
+        with torch.no_grad(), warnings.catch_warnings():
+            # Shape checks traced as constants are fine for fixed-size inputs
+            warnings.simplefilter("ignore", torch.jit.TracerWarning)
+            traced = torch.jit.trace(model, example, check_trace=False)
+        model = torch.jit.freeze(traced.eval())
+        if persist:
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            torch.jit.save(model, tmp_path)
+            os.replace(tmp_path, path)
+            logger.info(f"Exported optimized {name} to {path}")
+
+    return _compile(model)
+
+
+def _compile(model: torch.nn.Module) -> torch.nn.Module:
+    if MODEL_COMPILE == "inductor":
+        return torch.compile(model)
+    return model
+
+
+def prepare_input(batch: torch.Tensor) -> torch.Tensor:
+    """Lay out an NCHW batch the way an optimized conv model expects."""
+    if MODEL_CHANNELS_LAST:
+        return batch.contiguous(memory_format=torch.channels_last)
+    return batch
+
+
+def cosine_drift(baseline: np.ndarray, optimized: np.ndarray) -> dict:
+    """Cosine similarity between baseline and optimized embeddings, row by row."""
+    baseline = baseline / np.linalg.norm(baseline, axis=1, keepdims=True)
+    optimized = optimized / np.linalg.norm(optimized, axis=1, keepdims=True)
+    cosine = np.einsum("ij,ij->i", baseline, optimized)
+    return {
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        "p5_cosine": float(np.percentile(cosine, 5)),
+    }
@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import random
+import logging
+import itertools
+import functools
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from config import PROFILE_SAMPLE_RATE, PROFILE_TOKEN, PROFILE_INTERVAL_MS, PROFILE_HISTORY
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Innermost frames of threads that are waiting rather than working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+# Recent profiles, newest last; each holds collapsed stacks
+_profiles: "deque[Dict[str, Any]]" = deque(maxlen=PROFILE_HISTORY)
+_profiles_lock = threading.Lock()
+_ids = itertools.count(1)
+
+# One sampled request at a time: the sampler sees every thread
+_sampling = threading.Lock()
+
+# Model calls left to capture with torch.profiler
+_torch_passes = 0
+
+
+def _record(
+    profile_id: int, kind: str, name: str, started: float, seconds: float,
+    stacks: Counter, unit: str,
+) -> None:
+    with _profiles_lock:
+        _profiles.append(
+            {
+                "id": profile_id,
+                "kind": kind,
+                "name": name,
+                "started": started,
+                "seconds": seconds,
+                "unit": unit,
+                "total": sum(stacks.values()),
+                "stacks": stacks,
+            }
+        )
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Kept profiles, newest first, without their stacks."""
+    with _profiles_lock:
+        return [
+            {key: value for key, value in profile.items() if key != "stacks"}
+            for profile in reversed(_profiles)
+        ]
+
+
+def get_profile(profile_id: Optional[int] = None, kind: Optional[str] = None):
+    """A kept profile by id, or the newest one (of a kind); None if there is none."""
+    with _profiles_lock:
+        for profile in reversed(_profiles):
+            if profile_id is not None and profile["id"] != profile_id:
+                continue
+            if kind is not None and profile["kind"] != kind:
+                continue
+            return profile
+    return None
+
+
+def collapsed(profile: Dict[str, Any]) -> str:
+    """Collapsed stacks, one "frame;frame;frame weight" line each.
+
+    This is the input format of flamegraph.pl, inferno and speedscope.
+    """
+    return "".join(
+        f"{stack} {int(weight)}\n" for stack, weight in sorted(profile["stacks"].items())
+    )
+
+
+class StackSampler:
+    """Samples the Python stack of every busy thread at a fixed interval.
+
+    Threads waiting on a lock, queue or selector are left out, so the
+    counts show where work happened. Stacks are rooted at the thread name.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def __enter__(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+def should_profile(header: Optional[str]) -> bool:
+    """Whether to sample a request: it sent the profiling token, or was drawn at random."""
+    if header is not None and PROFILE_TOKEN and header == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+@contextmanager
+def sample_request(name: str) -> Iterator[Optional[int]]:
+    """Sample stacks while the block runs; yields the profile id.
+
+    Yields None (and samples nothing) while another request is being sampled.
+    """
+    if not _sampling.acquire(blocking=False):
+        yield None
+        return
+    profile_id = next(_ids)
+    started, start = time.time(), time.perf_counter()
+    try:
+        with StackSampler() as sampler:
+            yield profile_id
+    finally:
+        _sampling.release()
+        _record(
+            profile_id, "request", name, started, time.perf_counter() - start,
+            sampler.stacks, "samples",
+        )
+
+
+def arm_torch_capture(passes: int) -> None:
+    """Capture the next ``passes`` model calls with torch.profiler."""
+    global _torch_passes
+    with _profiles_lock:
+        _torch_passes = max(0, passes)
+
+
+def _claim_torch_pass() -> bool:
+    global _torch_passes
+    with _profiles_lock:
+        if _torch_passes <= 0:
+            return False
+        _torch_passes -= 1
+        return True
+
+
+def torch_profiled(name: str) -> Callable:
+    """Run the decorated model call under torch.profiler when a capture is armed.
+
+    The profile keeps self CPU time (microseconds) per operator call stack.
+    When no capture is armed the call costs one integer comparison.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _torch_passes <= 0 or not _claim_torch_pass():
+                return fn(*args, **kwargs)
+
+            from torch import profiler
+
+            profile_id = next(_ids)
+            started, start = time.time(), time.perf_counter()
+            with profiler.profile(activities=[profiler.ProfilerActivity.CPU]) as prof:
+                with profiler.record_function(name):
+                    result = fn(*args, **kwargs)
+            seconds = time.perf_counter() - start
+
+            stacks: Counter = Counter()
+            for event in prof.events():
+                names = []
+                parent = event
+                while parent is not None:
+                    names.append(parent.name)
+                    parent = parent.cpu_parent
+                stacks[";".join(reversed(names))] += event.self_cpu_time_total
+            _record(profile_id, "torch", name, started, seconds, stacks, "us")
+            logger.info(f"Captured torch profile {profile_id} of {name}")
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,302 @@
+import logging
+import numpy as np
+from typing import Dict, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows decoded per block when scoring compressed codes
+SCORE_BLOCK_SIZE = 16384
+# Vectors needed to fit a PCA projection (or int8 scales) that generalizes
+MIN_FIT_SAMPLE_SIZE = 1024
+
+
+def kmeans(
+    vectors: np.ndarray, n_clusters: int, n_iter: int = 15, seed: int = 42
+) -> np.ndarray:
+    """Euclidean k-means (Lloyd) returning the centroids."""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, vectors.shape[0])
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Re-seed empty clusters from random points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()))]
+            counts[empty] = 1
+
+        centroids = sums / counts[:, None]
+
+    return centroids.astype(np.float32)
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid (squared L2) for each vector."""
+    distances = (
+        -2 * vectors @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    )
+    return np.argmin(distances, axis=1)
+
+
+class Codec:
+    """Compressed storage for L2-normalized embeddings.
+
+    A codec is fitted on a sample of at least ``min_train_size`` vectors
+    (and may be refitted later), then encodes rows into a compact 2-D code
+    array and scores a float32 query against those codes
+    without decoding the whole matrix. An optional PCA projection is applied
+    before quantization; projected vectors are re-normalized so scores stay
+    on the cosine scale.
+    """
+
+    kind = "none"
+    min_train_size = 1
+
+    def __init__(self, pca_dim: int = 0):
+        self.pca_dim = pca_dim
+        self.min_train_size = max(
+            type(self).min_train_size, MIN_FIT_SAMPLE_SIZE if pca_dim else 0, pca_dim
+        )
+        self.dim = 0
+        self.is_trained = False
+        self._pca_components: Optional[np.ndarray] = None
+
+    def fit(self, vectors: np.ndarray) -> None:
+        if self.pca_dim and self.pca_dim < vectors.shape[1]:
+            # Uncentered second moment: projecting without a mean keeps dot
+            # products, and so cosine scores, comparable to the full vectors
+            moment = vectors.T @ vectors / len(vectors)
+            # eigh returns ascending eigenvalues; keep the largest
+            _, eigenvectors = np.linalg.eigh(moment)
+            self._pca_components = np.ascontiguousarray(
+                eigenvectors[:, ::-1][:, : self.pca_dim], dtype=np.float32
+            )
+        projected = self._project(vectors)
+        self.dim = projected.shape[1]
+        self._fit(projected)
+        self.is_trained = True
+        logger.info(
+            f"Fitted {self.kind} codec on {vectors.shape[0]} vectors "
+            f"({self.bytes_per_vector} bytes per vector)"
+        )
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return self._encode(self._project(vectors))
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Approximate vectors in the (possibly projected) code space."""
+        return self._decode(codes)
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarity of a projected query to each code row."""
+        return self._score(codes, query)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        """Map full-precision vectors into the code space."""
+        return self._project(vectors)
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return 4 * self.dim
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._pca_components is None:
+            return vectors
+        projected = vectors @ self._pca_components
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return projected / norms
+
+    def state(self) -> Dict[str, np.ndarray]:
+        arrays = {"codec_kind": np.array(self.kind), "codec_dim": np.array(self.dim)}
+        if self._pca_components is not None:
+            arrays["codec_pca_components"] = self._pca_components
+        arrays.update(self._state())
+        return arrays
+
+    def load_state(self, data) -> None:
+        if str(data["codec_kind"]) != self.kind:
+            raise ValueError(f"Stored codec is {data['codec_kind']}, not {self.kind}")
+        if "codec_pca_components" in data:
+            self._pca_components = data["codec_pca_components"]
+            if self._pca_components.shape[1] != self.pca_dim:
+                raise ValueError("Stored PCA dimension does not match configuration")
+        self._load_state(data)
+        self.dim = int(data["codec_dim"])
+        self.is_trained = True
+
+    # Hooks for subclasses
+    def _fit(self, vectors: np.ndarray) -> None:
+        pass
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes
+
+    def _score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return codes @ query
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    def _load_state(self, data) -> None:
+        pass
+
+
+class Float16Codec(Codec):
+    """Half-precision storage: 2 bytes per dimension."""
+
+    kind = "float16"
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return 2 * self.dim
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.astype(np.float16)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32)
+
+    def _score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_BLOCK_SIZE):
+            block = codes[start : start + SCORE_BLOCK_SIZE]
+            scores[start : start + SCORE_BLOCK_SIZE] = block.astype(np.float32) @ query
+        return scores
+
+
+class Int8Codec(Codec):
+    """Symmetric per-dimension int8 scalar quantization: 1 byte per dimension."""
+
+    kind = "int8"
+    min_train_size = MIN_FIT_SAMPLE_SIZE
+
+    def __init__(self, pca_dim: int = 0):
+        super().__init__(pca_dim)
+        self._scale: Optional[np.ndarray] = None
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.dim
+
+    def _fit(self, vectors: np.ndarray) -> None:
+        scale = np.abs(vectors).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        self._scale = scale.astype(np.float32)
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self._scale), -127, 127).astype(np.int8)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self._scale
+
+    def _score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # Fold the per-dimension scale into the query once
+        scaled_query = query * self._scale
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_BLOCK_SIZE):
+            block = codes[start : start + SCORE_BLOCK_SIZE]
+            scores[start : start + SCORE_BLOCK_SIZE] = (
+                block.astype(np.float32) @ scaled_query
+            )
+        return scores
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {"codec_scale": self._scale}
+
+    def _load_state(self, data) -> None:
+        self._scale = data["codec_scale"]
+
+
+class PQCodec(Codec):
+    """Product quantization with asymmetric distance computation (ADC).
+
+    Vectors are split into ``n_subvectors`` chunks, each replaced by the id of
+    its nearest sub-centroid (one byte). A query builds one lookup table of
+    sub-centroid dot products, and a row's score is the sum of its table
+    entries.
+    """
+
+    kind = "pq"
+    min_train_size = MIN_FIT_SAMPLE_SIZE
+
+    def __init__(self, pca_dim: int = 0, n_subvectors: int = 64, n_centroids: int = 256):
+        super().__init__(pca_dim)
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self._codebooks: Optional[np.ndarray] = None
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.n_subvectors
+
+    def _fit(self, vectors: np.ndarray) -> None:
+        dim = vectors.shape[1]
+        if dim % self.n_subvectors != 0:
+            raise ValueError(
+                f"Dimension {dim} is not divisible by {self.n_subvectors} subvectors"
+            )
+        sub_dim = dim // self.n_subvectors
+        codebooks = np.zeros(
+            (self.n_subvectors, self.n_centroids, sub_dim), dtype=np.float32
+        )
+        for m in range(self.n_subvectors):
+            sub = vectors[:, m * sub_dim : (m + 1) * sub_dim]
+            centroids = kmeans(sub, self.n_centroids, seed=m)
+            codebooks[m, : len(centroids)] = centroids
+        self._codebooks = codebooks
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub_dim = self._codebooks.shape[2]
+        codes = np.empty((vectors.shape[0], self.n_subvectors), dtype=np.uint8)
+        for m in range(self.n_subvectors):
+            sub = vectors[:, m * sub_dim : (m + 1) * sub_dim]
+            codes[:, m] = assign(sub, self._codebooks[m])
+        return codes
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self._codebooks[m][codes[:, m]] for m in range(self.n_subvectors)]
+        return np.hstack(parts)
+
+    def _score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        sub_dim = self._codebooks.shape[2]
+        # (n_subvectors, n_centroids) table of partial dot products
+        table = np.einsum(
+            "mkd,md->mk", self._codebooks, query.reshape(self.n_subvectors, sub_dim)
+        )
+        scores = np.zeros(codes.shape[0], dtype=np.float32)
+        for m in range(self.n_subvectors):
+            scores += table[m][codes[:, m]]
+        return scores
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {"codec_codebooks": self._codebooks}
+
+    def _load_state(self, data) -> None:
+        self._codebooks = data["codec_codebooks"]
+        if self._codebooks.shape[0] != self.n_subvectors:
+            raise ValueError("Stored PQ subvector count does not match configuration")
+
+
+def create_codec(kind: str, pca_dim: int = 0, n_subvectors: int = 64) -> Optional[Codec]:
+    """Create an unfitted codec ("none", "float16", "int8" or "pq")."""
+    if kind == "none":
+        return Codec(pca_dim) if pca_dim else None
+    if kind == "float16":
+        return Float16Codec(pca_dim)
+    if kind == "int8":
+        return Int8Codec(pca_dim)
+    if kind == "pq":
+        return PQCodec(pca_dim, n_subvectors=n_subvectors)
+    raise ValueError(f"Unknown embedding compression: {kind}")
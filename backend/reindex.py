@@ -0,0 +1,239 @@
+"""Re-embed the catalog into a new embedding version and switch to it with no downtime.
+
+A version is built offline in a pool of worker processes, under its own
+tag, while the API keeps serving the live version. Activating a version
+checks that it covers the catalog and swaps it in with one database
+transaction; running servers pick it up within INDEX_SYNC_SECONDS. Earlier
+versions are kept for rollback until pruned. Run with the configuration
+(and code) that should produce the new embeddings:
+
+    EMBEDDING_MODEL=clip python reindex.py build --tag clip-v2 --activate
+    python reindex.py list
+    python reindex.py rollback
+    python reindex.py prune --keep 1
+"""
+
+import os
+
+# Set tokenizers parallelism before importing any HuggingFace libraries
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import argparse
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from typing import Any, Dict, List
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_SETTINGS,
+    INDEX_SYNC_SECONDS,
+    INGEST_BATCH_SIZE,
+    REINDEX_MIN_COVERAGE,
+    REINDEX_WORKERS,
+)
+from database import (
+    activate_embedding_version,
+    close_connections,
+    create_embedding_version,
+    drop_embedding_version,
+    init_db,
+    load_embedding_versions,
+    load_product_attributes,
+    load_products_without_version_features,
+    load_version_features,
+    save_version_features,
+    set_embedding_version_status,
+)
+from vector_index import create_index, remove_index_files, version_index_path
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Products handed to a worker process at a time
+CHUNK_SIZE = 1000
+
+# Loaded once in the parent and inherited by the forked workers
+_models: Dict[str, Any] = {}
+
+
+def _embed_chunk(
+    tag: str, workers: int, batch_size: int, products: List[Dict[str, Any]]
+) -> int:
+    """Embed products into a version; runs in a worker process."""
+    from ingestion import ingest_products
+    from model_optimization import configure_threads, threads_per_worker
+
+    configure_threads(threads_per_worker(workers), force=True)
+    return ingest_products(
+        products,
+        _models["model"],
+        _models["classifier"],
+        batch_size=batch_size,
+        save=partial(save_version_features, tag),
+    )
+
+
+def embed_products(
+    tag: str, products: List[Dict[str, Any]], workers: int, batch_size: int
+) -> int:
+    """Embed products into a version with a pool of forked worker processes."""
+    if not products:
+        return 0
+    if "classifier" not in _models:
+        from fashion_classifier import create_classifier
+        from image_utils import load_model
+        from model_optimization import configure_threads
+
+        # Loading runs forward passes, and a child forked after multithreaded
+        # torch work hangs on its first op; each worker sets its own count
+        configure_threads(1, force=True)
+        _models["classifier"] = create_classifier()
+        _models["model"] = load_model()
+
+    chunks = [products[i : i + CHUNK_SIZE] for i in range(0, len(products), CHUNK_SIZE)]
+    embed = partial(_embed_chunk, tag, workers, batch_size)
+    if workers <= 1:
+        return sum(embed(chunk) for chunk in chunks)
+
+    # Workers open their own database connections
+    close_connections()
+    saved = 0
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = [pool.submit(embed, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            saved += future.result()
+            logger.info(f"Embedded {saved}/{len(products)} products into {tag}")
+    return saved
+
+
+def save_version_index(tag: str) -> int:
+    """Build and save the search index for a version; returns its size."""
+    index = create_index()
+    index.build(load_version_features(tag))
+    index.set_attributes_many(load_product_attributes())
+    index.save(version_index_path(tag))
+    return len(index)
+
+
+def activate(tag: str, min_coverage: float) -> None:
+    if not os.path.exists(version_index_path(tag)):
+        save_version_index(tag)
+    result = activate_embedding_version(tag, min_coverage)
+    logger.info(
+        f"Activated {tag} ({result['covered']}/{result['total']} products); "
+        f"{result['previous']} is kept for rollback. Servers switch within "
+        f"{INDEX_SYNC_SECONDS:.0f}s."
+    )
+
+
+def build(args) -> None:
+    tag = args.tag or f"{EMBEDDING_MODEL}-{time.strftime('%Y%m%d%H%M%S')}"
+    create_embedding_version(tag, EMBEDDING_MODEL, EMBEDDING_SETTINGS)
+    logger.info(f"Building embedding version {tag} with {EMBEDDING_MODEL}")
+
+    started = time.perf_counter()
+    # The second pass catches products added or changed during the first
+    for _ in range(2):
+        pending = load_products_without_version_features(tag)
+        if not pending:
+            break
+        logger.info(f"Embedding {len(pending)} products into {tag}")
+        embed_products(tag, pending, args.workers, args.batch_size)
+
+    missing = len(load_products_without_version_features(tag))
+    set_embedding_version_status(tag, "ready")
+    size = save_version_index(tag)
+    logger.info(
+        f"Built {tag}: {size} products embedded, {missing} missing, "
+        f"in {time.perf_counter() - started:.0f}s"
+    )
+    if args.activate:
+        activate(tag, args.min_coverage)
+
+
+def rollback(args) -> None:
+    """Re-activate the most recently retired version."""
+    retired = [
+        v for v in load_embedding_versions() if v["status"] == "retired" and v["activated_at"]
+    ]
+    if not retired:
+        raise SystemExit("No earlier embedding version to roll back to")
+    previous = max(retired, key=lambda v: v["activated_at"])
+    activate(previous["tag"], args.min_coverage)
+
+
+def prune(args) -> None:
+    """Drop the given versions, or all retired versions but the newest ``--keep``."""
+    versions = load_embedding_versions()
+    if args.tags:
+        tags = args.tags
+    else:
+        retired = sorted(
+            (v for v in versions if v["status"] == "retired"),
+            key=lambda v: v["activated_at"] or v["created_at"],
+            reverse=True,
+        )
+        tags = [v["tag"] for v in retired[args.keep :]]
+    for tag in tags:
+        drop_embedding_version(tag)
+        remove_index_files(version_index_path(tag))
+        logger.info(f"Pruned embedding version {tag}")
+
+
+def list_versions(args) -> None:
+    print(f"{'tag':<32}{'status':<10}{'model':<10}{'features':>10}  activated")
+    for v in load_embedding_versions():
+        activated = (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(v["activated_at"]))
+            if v["activated_at"]
+            else "-"
+        )
+        features = "-" if v["features"] is None else v["features"]
+        print(
+            f"{v['tag']:<32}{v['status']:<10}{v['model'] or '-':<10}{features:>10}  {activated}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Embed the catalog into a new version")
+    build_parser.add_argument("--tag", help="Version tag (default: model and timestamp)")
+    build_parser.add_argument("--workers", type=int, default=REINDEX_WORKERS)
+    build_parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    build_parser.add_argument("--activate", action="store_true", help="Activate when built")
+    build_parser.add_argument("--min-coverage", type=float, default=REINDEX_MIN_COVERAGE)
+    build_parser.set_defaults(run=build)
+
+    activate_parser = commands.add_parser("activate", help="Make a built version live")
+    activate_parser.add_argument("tag")
+    activate_parser.add_argument("--min-coverage", type=float, default=REINDEX_MIN_COVERAGE)
+    activate_parser.set_defaults(run=lambda args: activate(args.tag, args.min_coverage))
+
+    rollback_parser = commands.add_parser("rollback", help="Re-activate the previous version")
+    rollback_parser.add_argument("--min-coverage", type=float, default=0.0)
+    rollback_parser.set_defaults(run=rollback)
+
+    prune_parser = commands.add_parser("prune", help="Delete retired versions")
+    prune_parser.add_argument("tags", nargs="*", help="Versions to delete")
+    prune_parser.add_argument("--keep", type=int, default=1, help="Retired versions to keep")
+    prune_parser.set_defaults(run=prune)
+
+    list_parser = commands.add_parser("list", help="Show embedding versions")
+    list_parser.set_defaults(run=list_versions)
+
+    args = parser.parse_args()
+    init_db()
+    try:
+        args.run(args)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Serve the API from several worker processes that share preloaded models.
+
+The catalog, both models and the embedding index are loaded once in this
+process, then the workers are forked and inherit the model weights
+copy-on-write. The index vectors are memory-mapped from disk, so every
+worker reads the same copy from the page cache. The first worker ingests
+new products and saves the index as it changes; the others reload it. Each
+worker gets an equal share of the cores for torch (unless TORCH_NUM_THREADS
+is set). With one worker this is plain uvicorn.
+
+    python serve.py --workers 4 --port 8000
+"""
+
+import os
+
+# Set tokenizers parallelism before importing any HuggingFace libraries
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import argparse
+import logging
+import signal
+import socket
+import time
+import uvicorn
+from config import SERVE_WORKERS
+from metrics import process_memory
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between logged reports of worker memory
+MEMORY_REPORT_SECONDS = 60
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(worker_id: int, workers: int, sock: socket.socket, args) -> None:
+    os.environ["SERVE_WORKER_ID"] = str(worker_id)
+    from model_optimization import configure_threads, threads_per_worker
+    import main
+
+    threads = configure_threads(threads_per_worker(workers), force=True)
+    logger.info(f"Worker {worker_id} (pid {os.getpid()}) serving with {threads} threads")
+    config = uvicorn.Config(main.app, log_level=args.log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn(worker_id: int, workers: int, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(worker_id, workers, sock, args)
+        except BaseException:
+            logger.exception(f"Worker {worker_id} failed")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def _report_memory(workers: dict) -> None:
+    total_pss = 0
+    for pid, worker_id in sorted(workers.items(), key=lambda item: item[1]):
+        try:
+            memory = process_memory(pid)
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        total_pss += memory["pss"]
+        logger.info(
+            f"Worker {worker_id} (pid {pid}): RSS {memory['rss'] / 2**20:.0f} MiB, "
+            f"PSS {memory['pss'] / 2**20:.0f} MiB, shared {memory['shared'] / 2**20:.0f} MiB"
+        )
+    logger.info(f"Workers' combined PSS: {total_pss / 2**20:.0f} MiB")
+
+
+def serve(host: str, port: int, workers: int, args) -> None:
+    import main
+
+    logger.info(f"Preloading models and the index for {workers} workers...")
+    main.preload()
+    sock = _bind(host, port)
+    children = {_spawn(i, workers, sock, args): i for i in range(workers)}
+    logger.info(f"Serving on {host}:{port} with {workers} workers")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    last_report = time.monotonic()
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(1)
+            if time.monotonic() - last_report >= MEMORY_REPORT_SECONDS:
+                _report_memory(children)
+                last_report = time.monotonic()
+            continue
+
+        worker_id = children.pop(pid)
+        if not stopping:
+            logger.warning(
+                f"Worker {worker_id} (pid {pid}) exited with status {status}, restarting"
+            )
+            children[_spawn(worker_id, workers, sock, args)] = worker_id
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run("main:app", host=args.host, port=args.port, log_level=args.log_level)
+    else:
+        serve(args.host, args.port, args.workers, args)
+
+
+if __name__ == "__main__":
+    main()
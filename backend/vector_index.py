@@ -0,0 +1,870 @@
+import os
+import glob
+import uuid
+import threading
+import logging
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from config import (
+    INDEX_BACKEND,
+    IVF_NLIST,
+    IVF_NPROBE,
+    EMBEDDING_COMPRESSION,
+    PCA_DIM,
+    PQ_SUBVECTORS,
+    RERANK_CANDIDATES,
+    INDEX_PATH,
+)
+from database import INITIAL_EMBEDDING_VERSION, load_product_features_by_ids
+from quantization import Codec, create_codec
+from metrics import timed
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Product attributes held per row for filtered search; price is numeric
+CATEGORICAL_ATTRIBUTES = ("category", "color")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize vectors row-wise as float32 (zero rows are left as zeros)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: Optional[int]) -> np.ndarray:
+    """Return the indices of the k highest scores, best first."""
+    n = scores.shape[0]
+    if k is None or k >= n:
+        return np.argsort(-scores)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def append_rows(array: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Return ``array`` with ``rows`` appended, leaving room to grow.
+
+    The result is a view of a buffer with spare capacity. Appending to such
+    a view fills the spare rows in place and the buffer doubles when full,
+    so a run of single-row appends costs amortized O(1) per row.
+    """
+    n = len(array)
+    needed = n + len(rows)
+    buffer = array.base
+    reusable = (
+        isinstance(buffer, np.ndarray)
+        and buffer.flags.owndata
+        and buffer.flags.writeable
+        and buffer.dtype == rows.dtype
+        and buffer.shape[1:] == rows.shape[1:]
+        and len(buffer) >= needed
+        and array.ctypes.data == buffer.ctypes.data
+    )
+    if not reusable:
+        buffer = np.empty((max(needed, 2 * n, 16),) + rows.shape[1:], dtype=rows.dtype)
+        if n:
+            buffer[:n] = array
+    buffer[n:needed] = rows
+    return buffer[:needed]
+
+
+def spherical_kmeans(
+    vectors: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 42
+) -> np.ndarray:
+    """Cluster normalized vectors by cosine similarity and return the centroids."""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, vectors.shape[0])
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(vectors.shape[0], len(empty))]
+
+        centroids = normalize(sums)
+
+    return centroids
+
+
+class VectorIndex:
+    """Resident embedding index for cosine similarity search.
+
+    Product vectors are kept L2-normalized in a single matrix with an
+    id-to-row map. Subclasses decide which rows are scored for a query.
+
+    With a codec, rows are stored compressed once enough vectors exist to
+    fit it, and scores are approximate. The codec is refitted whenever the
+    index has doubled since, from full-precision vectors fetched through
+    ``rerank_loader``. If ``rerank_candidates`` is set, the best approximate
+    candidates are re-scored against those vectors too.
+
+    ``version`` increases on every change to the indexed vectors or their
+    attributes, so callers can tell when results computed earlier are stale.
+
+    Category, color and price are kept per row so searches can be filtered
+    before scoring. Categorical filters use cached per-value bitmaps and price
+    ranges a cached price-sorted row order; both are rebuilt lazily after
+    attributes or rows change. Attributes set for products not yet in the
+    index are held until their vectors arrive.
+    """
+
+    kind = "base"
+    # Vectors sampled to fit a codec
+    max_codec_train_size = 20000
+
+    def __init__(
+        self,
+        codec: Optional[Codec] = None,
+        rerank_candidates: int = 0,
+        rerank_loader: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None,
+    ):
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._ids: List[int] = []
+        self._id_to_row: Dict[int, int] = {}
+        self._dim = 0
+        self.codec = codec
+        self.rerank_candidates = rerank_candidates
+        self.rerank_loader = rerank_loader
+        # Rows when the codec was last fitted (or a refit was attempted)
+        self._codec_fit_size = 0
+        self.version = 0
+        # Attribute codes per row (-1 = unknown), value vocabularies, prices
+        self._codes = {a: np.empty(0, dtype=np.int32) for a in CATEGORICAL_ATTRIBUTES}
+        self._vocab: Dict[str, Dict[str, int]] = {a: {} for a in CATEGORICAL_ATTRIBUTES}
+        self._prices = np.empty(0, dtype=np.float32)
+        self._pending_attributes: Dict[int, Dict[str, Any]] = {}
+        self._bitmaps: Dict[Tuple[str, str], np.ndarray] = {}
+        self._price_order: Optional[np.ndarray] = None
+        self._sorted_prices = np.empty(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, product_id: int) -> bool:
+        return product_id in self._id_to_row
+
+    @property
+    def dim(self) -> int:
+        """Dimension of the full-precision vectors."""
+        return self._dim
+
+    @property
+    def ids(self) -> List[int]:
+        return list(self._ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the stored vectors or codes."""
+        return self._matrix.nbytes
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.codec is not None and self.codec.is_trained
+
+    def build(self, features: Dict[int, np.ndarray]) -> None:
+        """Replace the index contents with the given product features."""
+        ids = list(features.keys())
+        if ids:
+            matrix = normalize(np.vstack([features[pid].reshape(1, -1) for pid in ids]))
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+
+        with self._lock:
+            self.version += 1
+            self._matrix = matrix
+            self._remap_attributes(ids)
+            self._ids = ids
+            self._id_to_row = {pid: row for row, pid in enumerate(ids)}
+            self._dim = matrix.shape[1]
+            if not self._fit_codec(matrix):
+                self._matrix = self._encode(matrix)
+                self._on_build()
+
+        logger.info(f"Built {self.kind} index with {len(ids)} vectors")
+
+    def upsert(self, product_id: int, features: np.ndarray) -> None:
+        """Insert or replace a single product vector."""
+        vector = normalize(features)
+
+        with self._lock:
+            self.version += 1
+            if len(self._ids) == 0:
+                self._dim = vector.shape[1]
+                self._matrix = self._encode(vector)
+                self._ids = [product_id]
+                self._id_to_row = {product_id: 0}
+                self._append_attributes(product_id)
+                self._on_add(0)
+                return
+
+            if vector.shape[1] != self.dim:
+                raise ValueError(
+                    f"Feature dimension {vector.shape[1]} does not match index dimension {self.dim}"
+                )
+
+            code = self._encode(vector)
+            row = self._id_to_row.get(product_id)
+            if row is not None:
+                self._on_remove(row)
+                self._ensure_writable()
+                self._matrix[row] = code[0]
+            else:
+                row = len(self._ids)
+                self._matrix = append_rows(self._matrix, code)
+                self._id_to_row[product_id] = row
+                self._ids.append(product_id)
+                self._append_attributes(product_id)
+            if not self._fit_codec():
+                self._on_add(row)
+
+    def remove(self, product_id: int) -> None:
+        """Remove a product vector if present."""
+        with self._lock:
+            row = self._id_to_row.pop(product_id, None)
+            if row is None:
+                return
+            self.version += 1
+            self._on_remove(row)
+
+            # Move the last row into the freed slot
+            last = len(self._ids) - 1
+            if row != last:
+                self._on_remove(last)
+                self._ensure_writable()
+                self._matrix[row] = self._matrix[last]
+                moved_id = self._ids[last]
+                self._ids[row] = moved_id
+                self._id_to_row[moved_id] = row
+                for codes in self._codes.values():
+                    codes[row] = codes[last]
+                self._prices[row] = self._prices[last]
+                self._on_add(row)
+            self._matrix = self._matrix[:last]
+            self._ids.pop()
+            self._codes = {a: codes[:last] for a, codes in self._codes.items()}
+            self._prices = self._prices[:last]
+            self._invalidate_filters()
+
+    @timed("search")
+    def search(
+        self,
+        query: np.ndarray,
+        k: Optional[int] = None,
+        threshold: Optional[float] = None,
+        categories: Optional[Sequence[str]] = None,
+        colors: Optional[Sequence[str]] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+    ) -> List[Tuple[int, float]]:
+        """Return (product_id, cosine similarity) pairs, best first.
+
+        Only products matching every given filter (any of ``categories``,
+        any of ``colors``, price within the inclusive range) are scored.
+        """
+        query = normalize(query)
+        rerank = self.is_compressed and self.rerank_candidates > 0 and self.rerank_loader
+
+        with self._lock:
+            if len(self._ids) == 0:
+                return []
+            q = self._project(query)[0]
+            rows = self._candidates(q)
+            mask = self._filter_mask(categories, colors, min_price, max_price)
+            if mask is not None:
+                rows = self._filter_rows(rows, mask, k)
+                if len(rows) == 0:
+                    return []
+            matrix = self._matrix if rows is None else self._matrix[rows]
+            scores = self._score(matrix, q)
+
+            n_candidates = k
+            if rerank:
+                n_candidates = max(k or 0, self.rerank_candidates)
+            order = top_k(scores, n_candidates)
+            if rows is not None:
+                order_rows = rows[order]
+            else:
+                order_rows = order
+            matches = [(self._ids[row], float(scores[i])) for i, row in zip(order, order_rows)]
+
+        if rerank:
+            matches = self._rerank(matches, query[0])[:k]
+
+        if threshold is not None:
+            matches = [(pid, score) for pid, score in matches if score >= threshold]
+        return matches
+
+    def search_many(
+        self,
+        queries: np.ndarray,
+        k: Optional[int] = None,
+        threshold: Optional[float] = None,
+        categories: Optional[Sequence[str]] = None,
+        colors: Optional[Sequence[str]] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """Search several queries (one per row) with the same k, threshold and filters.
+
+        When every query scans the same rows (an uncompressed flat index, or
+        an IVF index before training), all queries are scored in one
+        matrix-matrix product; otherwise each query is searched in turn.
+        """
+        queries = normalize(queries)
+        if self.is_compressed or not self._scans_all_rows():
+            return [
+                self.search(query, k, threshold, categories, colors, min_price, max_price)
+                for query in queries
+            ]
+
+        with timed("search"), self._lock:
+            if len(self._ids) == 0:
+                return [[] for _ in queries]
+            rows = None
+            mask = self._filter_mask(categories, colors, min_price, max_price)
+            if mask is not None:
+                rows = self._filter_rows(None, mask, k)
+                if len(rows) == 0:
+                    return [[] for _ in queries]
+            matrix = self._matrix if rows is None else self._matrix[rows]
+            # (queries, rows): each query's scores are contiguous
+            scores = queries @ matrix.T
+
+            results = []
+            for query_scores in scores:
+                order = top_k(query_scores, k)
+                order_rows = order if rows is None else rows[order]
+                matches = [
+                    (self._ids[row], float(query_scores[i]))
+                    for i, row in zip(order, order_rows)
+                ]
+                if threshold is not None:
+                    matches = [(pid, score) for pid, score in matches if score >= threshold]
+                results.append(matches)
+        return results
+
+    def set_attributes(self, product_id: int, attributes: Dict[str, Any]) -> None:
+        """Set some of a product's filterable attributes (category, color, price)."""
+        self.set_attributes_many({product_id: attributes})
+
+    def set_attributes_many(self, attributes: Dict[int, Dict[str, Any]]) -> None:
+        """Set filterable attributes for many products at once."""
+        with self._lock:
+            self.version += 1
+            for product_id, values in attributes.items():
+                row = self._id_to_row.get(product_id)
+                if row is None:
+                    self._pending_attributes.setdefault(product_id, {}).update(values)
+                else:
+                    self._apply_attributes(row, values)
+            self._invalidate_filters()
+
+    def _apply_attributes(self, row: int, values: Dict[str, Any]) -> None:
+        for attribute in CATEGORICAL_ATTRIBUTES:
+            if attribute in values:
+                value = values[attribute]
+                if value is None:
+                    self._codes[attribute][row] = -1
+                else:
+                    vocab = self._vocab[attribute]
+                    self._codes[attribute][row] = vocab.setdefault(value, len(vocab))
+        if "price" in values:
+            price = values["price"]
+            self._prices[row] = np.nan if price is None else price
+
+    def _append_attributes(self, product_id: int) -> None:
+        """Grow the attribute arrays by one row for a newly added product."""
+        self._codes = {
+            a: append_rows(codes, np.array([-1], dtype=np.int32))
+            for a, codes in self._codes.items()
+        }
+        self._prices = append_rows(self._prices, np.array([np.nan], dtype=np.float32))
+        pending = self._pending_attributes.pop(product_id, None)
+        if pending:
+            self._apply_attributes(len(self._ids) - 1, pending)
+        self._invalidate_filters()
+
+    def _remap_attributes(self, ids: List[int]) -> None:
+        """Carry attributes over to a new row layout, before ``self._ids`` changes."""
+        old_rows = np.array([self._id_to_row.get(pid, -1) for pid in ids], dtype=np.int64)
+        kept = old_rows >= 0
+        codes = {}
+        for attribute, old_codes in self._codes.items():
+            codes[attribute] = np.full(len(ids), -1, dtype=np.int32)
+            codes[attribute][kept] = old_codes[old_rows[kept]]
+        prices = np.full(len(ids), np.nan, dtype=np.float32)
+        prices[kept] = self._prices[old_rows[kept]]
+
+        self._codes, self._prices = codes, prices
+        for row, pid in enumerate(ids):
+            pending = self._pending_attributes.pop(pid, None)
+            if pending:
+                self._apply_attributes(row, pending)
+        self._invalidate_filters()
+
+    def _invalidate_filters(self) -> None:
+        self._bitmaps = {}
+        self._price_order = None
+
+    def _bitmap(self, attribute: str, value: str) -> np.ndarray:
+        """Boolean row mask of products whose attribute equals value (cached)."""
+        key = (attribute, value)
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            code = self._vocab[attribute].get(value)
+            if code is None:
+                bitmap = np.zeros(len(self._ids), dtype=bool)
+            else:
+                bitmap = self._codes[attribute] == code
+            self._bitmaps[key] = bitmap
+        return bitmap
+
+    def _price_mask(self, min_price: Optional[float], max_price: Optional[float]) -> np.ndarray:
+        """Boolean row mask of prices within [min_price, max_price]."""
+        if self._price_order is None:
+            # Unknown (NaN) prices sort last and are never in range
+            order = np.argsort(self._prices, kind="stable")
+            known = int(np.count_nonzero(~np.isnan(self._prices)))
+            self._price_order = order
+            self._sorted_prices = self._prices[order[:known]]
+        prices = self._sorted_prices
+        low = 0 if min_price is None else int(np.searchsorted(prices, min_price, "left"))
+        high = len(prices) if max_price is None else int(np.searchsorted(prices, max_price, "right"))
+        mask = np.zeros(len(self._ids), dtype=bool)
+        mask[self._price_order[low:high]] = True
+        return mask
+
+    def _filter_mask(
+        self,
+        categories: Optional[Sequence[str]],
+        colors: Optional[Sequence[str]],
+        min_price: Optional[float],
+        max_price: Optional[float],
+    ) -> Optional[np.ndarray]:
+        """Rows passing every filter, or None when no filter is given."""
+        mask = None
+        for attribute, values in (("category", categories), ("color", colors)):
+            if values:
+                allowed = np.zeros(len(self._ids), dtype=bool)
+                for value in values:
+                    allowed |= self._bitmap(attribute, value)
+                mask = allowed if mask is None else mask & allowed
+        if min_price is not None or max_price is not None:
+            in_range = self._price_mask(min_price, max_price)
+            mask = in_range if mask is None else mask & in_range
+        return mask
+
+    def _filter_rows(
+        self, candidates: Optional[np.ndarray], mask: np.ndarray, k: Optional[int]
+    ) -> np.ndarray:
+        """Rows to score under a filter.
+
+        The filtered rows are scanned directly when they are fewer than the
+        candidates, or when the candidates hold fewer than k matches (a
+        selective filter would otherwise starve the probed lists).
+        """
+        allowed = np.flatnonzero(mask)
+        if candidates is None or len(allowed) <= len(candidates):
+            return allowed
+        probed = candidates[mask[candidates]]
+        if k is None or len(probed) >= k:
+            return probed
+        return allowed
+
+    def _rerank(
+        self, matches: List[Tuple[int, float]], query: np.ndarray
+    ) -> List[Tuple[int, float]]:
+        """Re-score approximate matches with full-precision vectors.
+
+        Vectors of another size (from an embedding version switched to but
+        not yet served) are skipped, keeping the approximate score.
+        """
+        features = self.rerank_loader([pid for pid, _ in matches])
+        rescored = []
+        for pid, score in matches:
+            if pid in features and features[pid].shape[-1] == query.shape[-1]:
+                score = float(normalize(features[pid])[0] @ query)
+            rescored.append((pid, score))
+        rescored.sort(key=lambda x: x[1], reverse=True)
+        return rescored
+
+    def save(self, path: str) -> None:
+        """Persist the index: metadata in an .npz file, vectors in an .npy beside it.
+
+        The vector matrix gets a new file name on every save and the .npz
+        records it, so the .npz is replaced atomically and processes that
+        memory-mapped an earlier matrix keep reading a consistent snapshot.
+        """
+        base = os.path.splitext(path)[0]
+        matrix_path = f"{base}.{uuid.uuid4().hex[:12]}.matrix.npy"
+        with self._lock:
+            arrays = {
+                "kind": np.array(self.kind),
+                "ids": np.array(self._ids, dtype=np.int64),
+                "matrix_file": np.array(os.path.basename(matrix_path)),
+                "dim": np.array(self._dim),
+                "prices": self._prices,
+            }
+            for attribute in CATEGORICAL_ATTRIBUTES:
+                vocab = self._vocab[attribute]
+                arrays[f"codes_{attribute}"] = self._codes[attribute]
+                arrays[f"values_{attribute}"] = np.array(
+                    sorted(vocab, key=vocab.get), dtype=str
+                )
+            if self.is_compressed:
+                arrays.update(self.codec.state())
+                arrays["codec_fit_size"] = np.array(self._codec_fit_size)
+            arrays.update(self._state())
+            np.save(matrix_path, np.ascontiguousarray(self._matrix))
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+        # Processes that still map an older matrix keep reading it once unlinked
+        for old in glob.glob(f"{glob.escape(base)}.{'[0-9a-f]' * 12}.matrix.npy"):
+            if old != matrix_path:
+                os.remove(old)
+        logger.info(f"Saved {self.kind} index with {len(self)} vectors to {path}")
+
+    def load(self, path: str, mmap: bool = True) -> None:
+        """Load an index previously written by save().
+
+        With ``mmap`` the vectors are memory-mapped read-only, so processes
+        loading the same file share one copy in the page cache; the first
+        change to the index copies them into private memory.
+        """
+        with np.load(path) as data:
+            if str(data["kind"]) != self.kind:
+                raise ValueError(f"Index at {path} is {data['kind']}, not {self.kind}")
+            stored_codec = str(data["codec_kind"]) if "codec_kind" in data else None
+            if stored_codec is not None:
+                if self.codec is None:
+                    raise ValueError(f"Index at {path} is compressed with {stored_codec}")
+                self.codec.load_state(data)
+            elif self.codec is not None and len(data["ids"]) >= self.codec.min_train_size:
+                raise ValueError(f"Index at {path} is not compressed with {self.codec.kind}")
+            if "matrix_file" in data:
+                matrix_path = os.path.join(os.path.dirname(path), str(data["matrix_file"]))
+                matrix = np.load(matrix_path, mmap_mode="r" if mmap else None)
+            else:
+                # Indexes saved before the matrix moved to its own file
+                matrix = data["matrix"]
+            with self._lock:
+                self.version += 1
+                self._matrix = matrix
+                ids = [int(pid) for pid in data["ids"]]
+                if "prices" in data:
+                    self._prices = data["prices"].astype(np.float32)
+                    for attribute in CATEGORICAL_ATTRIBUTES:
+                        self._codes[attribute] = data[f"codes_{attribute}"].astype(np.int32)
+                        values = [str(v) for v in data[f"values_{attribute}"]]
+                        self._vocab[attribute] = {v: code for code, v in enumerate(values)}
+                    self._invalidate_filters()
+                else:
+                    self._remap_attributes(ids)
+                self._ids = ids
+                self._id_to_row = {pid: row for row, pid in enumerate(self._ids)}
+                self._dim = int(data["dim"])
+                if stored_codec is not None:
+                    self._codec_fit_size = (
+                        int(data["codec_fit_size"]) if "codec_fit_size" in data else len(ids)
+                    )
+                self._load_state(data)
+        logger.info(f"Loaded {self.kind} index with {len(self)} vectors from {path}")
+
+    def _ensure_writable(self) -> None:
+        """Copy a memory-mapped matrix into private memory before changing it in place."""
+        if not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix)
+
+    def _fit_codec(self, vectors: Optional[np.ndarray] = None) -> bool:
+        """(Re)fit the codec and compress the stored rows; True if it was fitted.
+
+        ``vectors`` are every row at full precision, as build() has them; the
+        codec is then fitted afresh. Otherwise it is first fitted on the
+        uncompressed rows once ``min_train_size`` exist, and refitted once
+        the index has doubled since, on vectors fetched through
+        ``rerank_loader``.
+        """
+        if self.codec is None:
+            return False
+        n = len(self._ids)
+        if n < self.codec.min_train_size:
+            return False
+        if vectors is None:
+            if not self.codec.is_trained:
+                vectors = self._matrix
+            elif n >= 2 * self._codec_fit_size:
+                self._codec_fit_size = n
+                vectors = self._load_full_vectors()
+                if vectors is None:
+                    return False
+            else:
+                return False
+
+        sample = vectors
+        if n > self.max_codec_train_size:
+            rng = np.random.default_rng(42)
+            sample = vectors[rng.choice(n, self.max_codec_train_size, replace=False)]
+        self.codec.fit(sample)
+        self._codec_fit_size = n
+        self._matrix = self.codec.encode(vectors)
+
+        # Structures derived from the vectors now live in the code space
+        self._on_build()
+        return True
+
+    def _load_full_vectors(self) -> Optional[np.ndarray]:
+        """Every row's full-precision vector, or None if any can't be loaded."""
+        if self.rerank_loader is None:
+            return None
+        features: Dict[int, np.ndarray] = {}
+        for start in range(0, len(self._ids), 10000):
+            features.update(self.rerank_loader(self._ids[start : start + 10000]))
+        missing = [pid for pid in self._ids if pid not in features]
+        if missing or any(features[pid].shape[-1] != self._dim for pid in self._ids):
+            logger.warning(
+                f"Keeping the {self.codec.kind} codec: full-precision vectors are "
+                f"unavailable for {len(missing) or 'some'} products"
+            )
+            return None
+        return normalize(np.vstack([features[pid].reshape(1, -1) for pid in self._ids]))
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if not self.is_compressed:
+            return vectors
+        return self.codec.encode(vectors)
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        """Stored rows as float32 vectors in the code space."""
+        if not self.is_compressed:
+            return codes
+        return self.codec.decode(codes)
+
+    def _project(self, query: np.ndarray) -> np.ndarray:
+        if not self.is_compressed:
+            return query
+        return self.codec.project(query)
+
+    def _score(self, matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if not self.is_compressed:
+            return matrix @ query
+        return self.codec.score(matrix, query)
+
+    # Hooks for subclasses
+    def _on_build(self) -> None:
+        pass
+
+    def _on_add(self, row: int) -> None:
+        pass
+
+    def _on_remove(self, row: int) -> None:
+        pass
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows to score for a query, or None to score every row."""
+        return None
+
+    def _scans_all_rows(self) -> bool:
+        """Whether _candidates() scores every row for any query."""
+        return True
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    def _load_state(self, data) -> None:
+        pass
+
+
+class FlatIndex(VectorIndex):
+    """Exact brute-force search: one matrix-vector product over every row."""
+
+    kind = "flat"
+
+
+class IVFIndex(VectorIndex):
+    """Inverted-file index with a spherical k-means coarse quantizer.
+
+    Each vector is assigned to its nearest centroid; a query scores only the
+    rows in its ``nprobe`` closest lists. Until enough vectors exist to train
+    the quantizer, every row is scanned exactly.
+    """
+
+    kind = "ivf"
+
+    def __init__(
+        self,
+        nlist: int = 0,
+        nprobe: int = 8,
+        min_train_size: int = 1000,
+        max_train_size: int = 100000,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.max_train_size = max_train_size
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int64)
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+        self._trained_size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def train(self) -> None:
+        """(Re)train the coarse quantizer and rebuild the inverted lists."""
+        with self._lock:
+            n = len(self._ids)
+            nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+            sample = self._matrix
+            if n > self.max_train_size:
+                rng = np.random.default_rng(42)
+                sample = self._matrix[rng.choice(n, self.max_train_size, replace=False)]
+
+            self._centroids = spherical_kmeans(normalize(self._decode(sample)), nlist)
+            self._trained_size = n
+            self._assign_all()
+
+        logger.info(f"Trained IVF index with {len(self._centroids)} lists over {n} vectors")
+
+    def _assign_all(self) -> None:
+        n = len(self._ids)
+        assignments = np.empty(n, dtype=np.int64)
+        for start in range(0, n, 8192):
+            block = self._decode(self._matrix[start : start + 8192])
+            assignments[start : start + 8192] = np.argmax(block @ self._centroids.T, axis=1)
+
+        self._assignments = assignments
+        self._lists = [[] for _ in range(len(self._centroids))]
+        for row, list_id in enumerate(assignments):
+            self._lists[list_id].append(row)
+        self._list_arrays = {}
+
+    def _maybe_train(self) -> None:
+        n = len(self._ids)
+        if n < self.min_train_size:
+            return
+        # Retrain once the catalog has doubled since the last training
+        if not self.is_trained or n >= 2 * self._trained_size:
+            self.train()
+
+    def _on_build(self) -> None:
+        self._centroids = None
+        self._assignments = np.empty(0, dtype=np.int64)
+        self._lists = []
+        self._list_arrays = {}
+        self._trained_size = 0
+        self._maybe_train()
+
+    def _on_add(self, row: int) -> None:
+        if not self.is_trained:
+            self._maybe_train()
+            return
+        if row >= len(self._assignments):
+            self._assignments = np.resize(self._assignments, max(row + 1, 2 * len(self._assignments)))
+        vector = self._decode(self._matrix[row : row + 1])[0]
+        list_id = int(np.argmax(self._centroids @ vector))
+        self._assignments[row] = list_id
+        self._lists[list_id].append(row)
+        self._list_arrays.pop(list_id, None)
+        if len(self._ids) >= 2 * self._trained_size:
+            self.train()
+
+    def _on_remove(self, row: int) -> None:
+        if not self.is_trained:
+            return
+        list_id = int(self._assignments[row])
+        self._lists[list_id].remove(row)
+        self._list_arrays.pop(list_id, None)
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if not self.is_trained:
+            return None
+        probes = top_k(self._centroids @ query, self.nprobe)
+        arrays = []
+        for list_id in probes:
+            array = self._list_arrays.get(list_id)
+            if array is None:
+                array = np.array(self._lists[list_id], dtype=np.int64)
+                self._list_arrays[list_id] = array
+            arrays.append(array)
+        return np.concatenate(arrays)
+
+    def _scans_all_rows(self) -> bool:
+        return not self.is_trained
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        if not self.is_trained:
+            return {}
+        return {
+            "centroids": self._centroids,
+            "trained_size": np.array(self._trained_size),
+        }
+
+    def _load_state(self, data) -> None:
+        self._list_arrays = {}
+        if "centroids" in data:
+            self._centroids = data["centroids"].astype(np.float32)
+            self._trained_size = int(data["trained_size"])
+            self._assign_all()
+        else:
+            self._on_build()
+
+
+def create_index(
+    kind: str = INDEX_BACKEND,
+    nlist: int = IVF_NLIST,
+    nprobe: int = IVF_NPROBE,
+    compression: str = EMBEDDING_COMPRESSION,
+    pca_dim: int = PCA_DIM,
+    rerank_candidates: int = RERANK_CANDIDATES,
+) -> VectorIndex:
+    """Create an empty index of the given kind ("flat" or "ivf")."""
+    options = {
+        "codec": create_codec(compression, pca_dim, n_subvectors=PQ_SUBVECTORS),
+        "rerank_candidates": rerank_candidates,
+        "rerank_loader": load_product_features_by_ids,
+    }
+    if kind == "flat":
+        return FlatIndex(**options)
+    if kind == "ivf":
+        return IVFIndex(nlist=nlist, nprobe=nprobe, **options)
+    raise ValueError(f"Unknown index backend: {kind}")
+
+
+def version_index_path(version: str) -> str:
+    """Index file for an embedding version (INDEX_PATH for the initial one)."""
+    if version == INITIAL_EMBEDDING_VERSION:
+        return INDEX_PATH
+    base, ext = os.path.splitext(INDEX_PATH)
+    return f"{base}.{version}{ext}"
+
+
+def remove_index_files(path: str) -> None:
+    """Delete a saved index and its vector matrix."""
+    base = os.path.splitext(path)[0]
+    for name in [path] + glob.glob(f"{glob.escape(base)}.{'[0-9a-f]' * 12}.matrix.npy"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+# Shared index used by the API
+product_index = create_index()